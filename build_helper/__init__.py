@@ -1,2 +1,6 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
+import time
+
+# 开始导入build_helper的时间, 用于--timing输出启动耗时
+START_TIME = time.perf_counter()
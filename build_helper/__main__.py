@@ -1,18 +1,22 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
 import gzip
+import time
 from argparse import ArgumentParser
 
 from actions_toolkit import core
 
+from . import START_TIME
 from .utils.error import ConfigParseError, PrePareError
 from .utils.logger import debug, logger
+from .utils.network import log_host_stats
 from .utils.upload import uploader
 from .utils.utils import setup_env
 
 parser = ArgumentParser()
 parser.add_argument("--task", "-t", help="要执行的任务")
 parser.add_argument("--config", "-c", help="配置")
+parser.add_argument("--timing", action="store_true", help="输出启动与执行耗时")
 
 args = parser.parse_args()
 if args.config:
@@ -22,10 +26,18 @@ else:
     config = {}
 
 
+def report_timing(stage: str) -> None:
+    if args.timing:
+        logger.info("%s: %.1fms", stage, (time.perf_counter() - START_TIME) * 1000)
+
+
 def main() -> None:
+    # 任务模块在各分支中导入, 导入耗时计入"加载任务模块后"
+    report_timing("启动耗时")
     match args.task:
         case "prepare":
             from .prepare import get_matrix, parse_configs, prepare
+            report_timing("加载任务模块后")
             setup_env()
             try:
                 configs = parse_configs()
@@ -40,23 +52,30 @@ def main() -> None:
                 raise PrePareError(msg) from e
         case "build-prepare":
             from .build import prepare
+            report_timing("加载任务模块后")
             prepare(config)
         case "base-builds":
             from .build import base_builds
+            report_timing("加载任务模块后")
             base_builds(config)
         case "build_packages":
             from .build import build_packages
+            report_timing("加载任务模块后")
             build_packages(config)
         case "build_image_builder":
             from .build import build_image_builder
+            report_timing("加载任务模块后")
             build_image_builder(config)
         case "build_images_releases":
             from .build import build_images
+            report_timing("加载任务模块后")
             build_images(config)
             from .releases import releases
             releases(config)
 
     uploader.save()
+    log_host_stats()
+    report_timing("总耗时")
 
 if __name__ == "__main__":
     try:
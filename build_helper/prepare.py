@@ -5,20 +5,27 @@ import json
 import os
 import re
 import shutil
-import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from multiprocessing.pool import Pool
 from typing import Any
 
 import pygit2
 
+from .utils.cache import HTTP_CACHE_PREFIX
+from .utils.cores import CORE_CACHE_PREFIX, get_adguardhome, get_core_versions, install_openclash, prune_cores
 from .utils.downloader import DLTask, dl2, wait_dl_tasks
 from .utils.error import ConfigError, ConfigParseError
+from .utils.feeds import FEEDS_CACHE_PREFIX, get_feeds_cache
 from .utils.logger import logger
-from .utils.network import get_gh_repo_last_releases, request_get
+from .utils.metadata import prune_snapshots
+from .utils.mirror import GIT_MIRROR_CACHE_PREFIX, STAMP_SUFFIX, GitMirror, fetch_refs, get_git_mirror
+from .utils.network import request_get
 from .utils.openwrt import OpenWrt
 from .utils.paths import paths
-from .utils.repo import compiler, get_release_suffix, user_repo
+from .utils.repo import del_cache, get_compiler, get_release_suffix, get_user_repo, trim_caches
+from .utils.tasks import TaskGraph, init_worker
 from .utils.upload import uploader
 from .utils.utils import parse_config
 
@@ -84,82 +91,102 @@ def get_matrix(configs: dict[str, dict]) -> str:
         matrix["include"].append({"name": name, "config": gzip.compress(json.dumps(config, separators=(',', ':')).encode("utf-8")).hex().upper()})
     return json.dumps(matrix)
 
-def clone(repo: str, path: str, branch: str | None) -> tuple[str, str | None, str]:
-    logger.info("开始克隆仓库 %s", repo if not branch else f"{repo} (分支: {branch})")
-    pygit2.clone_repository(repo, path, checkout_branch=branch if branch else None, depth=1)
-    logger.info("仓库 %s 克隆完成", repo if not branch else f"{repo} (分支: {branch})")
-    return repo, branch, path
 
-def prepare(configs: dict[str, dict[str, Any]]) -> None:
-    # clone拓展软件源码
-    logger.info("开始克隆拓展软件源码...")
-    to_clone: set[tuple[str, str]] = {("https://github.com/immortalwrt/packages", ""),
-                                       ("https://github.com/chenmozhijin/turboacc", "package"),
-                                       ("https://github.com/pymumu/openwrt-smartdns", "master"),
-                                       ("https://github.com/pymumu/luci-app-smartdns", "master"),
-                                       *[(pkg["REPOSITORIE"], pkg["BRANCH"]) for config in configs.values() for pkg in config["extpackages"].values()],
-                                       *[("https://github.com/sbwml/packages_lang_golang",
-                                          config["openwrtext"]["golang_version"]) for config in configs.values()]}
-    cloned_repos: dict[tuple[str, str | None], str] = {}
-    with Pool(8) as p:
-        for repo, branch, path in p.starmap(clone,[
-                                             (repo,
-                                              os.path.join(paths.workdir, "repos", repo.split("/")[-2], repo.split("/")[-1],branch if branch else "@default@"),
-                                              branch)
-                                              for repo, branch in to_clone]):
-            cloned_repos[(repo, branch)] = path
-
-
-    logger.info("开始处理拓展软件源码...")
-    ext_pkg_paths = {os.path.join(cloned_repos[(pkg["REPOSITORIE"], pkg["BRANCH"])], pkg["PATH"])
-                     for config in configs.values() for pkg in config["extpackages"].values()}
-    for path in ext_pkg_paths:
-        logger.debug("处理拓展包 %s", path)
-        for root, dirs, files in os.walk(path):
-
-            # 修复Makefile中luci.mk的路径
-            for file in files:
-                if file == "Makefile":
-                    with open(os.path.join(root, file), encoding="utf-8") as f:
-                        content = f.read()
-                    content = content.replace(r"../../luci.mk", r"$(TOPDIR)/feeds/luci/luci.mk")
-                    with open(os.path.join(root, file), "w", encoding="utf-8") as f:
-                        f.write(content)
-                    logger.info("修复%s中luci.mk的路径", os.path.join(root, file))
-
-            # 创建符号链接以修复中文支持
-            for _dir in dirs:
-                if _dir == "po":
-                    po_path = os.path.join(root, _dir)
-                    zh_hans = os.path.join(po_path , "zh_Hans")
-                    zh_cn = os.path.join(po_path , "zh-cn")
-                    if not os.path.isdir(zh_cn):
-                        if os.path.isdir(zh_hans) or os.path.islink(zh_hans):
-                            logger.debug("已存在符号链接或目录 %s，跳过", zh_hans)
-                            continue
-                        if os.path.isfile(zh_hans):
-                            logger.info("已存在文件 %s，删除", zh_hans)
-                            os.remove(zh_hans)
-                        os.symlink("zh_Hans", zh_cn, target_is_directory=True)
-                        logger.info("创建符号链接 %s -> %s", zh_cn, zh_hans)
-                    elif not os.path.isdir(zh_hans) or not os.path.islink(zh_hans):
-                        logger.info("%s 中不存在汉化文件，这可能是该luci插件原生为中文或不支持中文", po_path)
-
-
-    logger.info("开始克隆openwrt源码...")
-    openwrt_paths = os.path.join(paths.workdir, "openwrts")
-    cfg_names = list(configs.keys())
-    pygit2.clone_repository("https://github.com/openwrt/openwrt", os.path.join(openwrt_paths, cfg_names[0]))
+# 拓展软件包处理完成的标识文件的后缀(在检出目录的标识文件后缀之前)
+FIXED_SUFFIX = ".fixed"
 
-    # 复制源码
-    if len(cfg_names) > 1:
-        for name in cfg_names[1:]:
-            shutil.copytree(os.path.join(openwrt_paths, cfg_names[0]), os.path.join(openwrt_paths, name), symlinks=True)
-    openwrts = {name: OpenWrt(os.path.join(openwrt_paths, name), configs[name]["compile"]["openwrt_tag/branch"]) for name in cfg_names}
 
+def clone(repo: str, checkouts: list[tuple[str, str, set[str] | None]]) -> None:
+    """从镜像缓存检出同一仓库的多个分支, 同一仓库的镜像只能由一个进程更新"""
+    mirror = get_git_mirror()
+    for branch, path, subdirs in checkouts:
+        logger.info("开始获取仓库 %s", repo if not branch else f"{repo} (分支: {branch})")
+        mirror.checkout(repo, branch or None, path, subdirs, derived=(FIXED_SUFFIX,))
+        logger.info("仓库 %s 获取完成", repo if not branch else f"{repo} (分支: {branch})")
+
+
+def fix_makefile(path: str) -> bool:
+    """修复Makefile中luci.mk的路径, 只重写包含../../luci.mk的文件"""
+    with open(path, "rb") as f:
+        content = f.read()
+    if b"../../luci.mk" not in content:
+        return False
+    with open(path, "wb") as f:
+        f.write(content.replace(b"../../luci.mk", b"$(TOPDIR)/feeds/luci/luci.mk"))
+    logger.info("修复%s中luci.mk的路径", path)
+    return True
+
+
+def fix_po(po_path: str) -> None:
+    """创建符号链接以修复中文支持"""
+    zh_hans = os.path.join(po_path , "zh_Hans")
+    zh_cn = os.path.join(po_path , "zh-cn")
+    if not os.path.isdir(zh_cn):
+        if os.path.isdir(zh_hans) or os.path.islink(zh_hans):
+            logger.debug("已存在符号链接或目录 %s，跳过", zh_hans)
+            return
+        if os.path.isfile(zh_hans):
+            logger.info("已存在文件 %s，删除", zh_hans)
+            os.remove(zh_hans)
+        os.symlink("zh_Hans", zh_cn, target_is_directory=True)
+        logger.info("创建符号链接 %s -> %s", zh_cn, zh_hans)
+    elif not os.path.isdir(zh_hans) or not os.path.islink(zh_hans):
+        logger.info("%s 中不存在汉化文件，这可能是该luci插件原生为中文或不支持中文", po_path)
+
+
+def fix_ext_packages(checkouts: dict[str, set[str]]) -> None:
+    """处理拓展软件包, checkouts为检出目录与其中拓展软件包路径的对应关系
+
+    先遍历一次目录建立Makefile与po目录的索引, 再并行处理。
+    处理完成后记录检出内容的标识, 内容没有变化的检出目录之后不再重复处理。
+    """
+    mirror = get_git_mirror()
+    makefiles: list[str] = []
+    po_dirs: list[str] = []
+    stamps: dict[str, str | None] = {}
+    for root, pkg_paths in checkouts.items():
+        stamp = mirror.read_stamp(root)
+        if stamp is not None and mirror.read_stamp(root + FIXED_SUFFIX) == stamp:
+            logger.debug("%s已处理过, 跳过", root)
+            continue
+        stamps[root] = stamp
+        for pkg_path in pkg_paths:
+            logger.debug("处理拓展包 %s", pkg_path)
+            for dirpath, dirs, files in os.walk(pkg_path):
+                if "Makefile" in files:
+                    makefiles.append(os.path.join(dirpath, "Makefile"))
+                if "po" in dirs:
+                    po_dirs.append(os.path.join(dirpath, "po"))
+
+    with ThreadPoolExecutor(os.cpu_count()) as executor:
+        fixed = sum(executor.map(fix_makefile, makefiles))
+        list(executor.map(fix_po, po_dirs))
+    logger.debug("检查了%s个Makefile与%s个po目录, 修复了%s个Makefile", len(makefiles), len(po_dirs), fixed)
+
+    for root, stamp in stamps.items():
+        if stamp is not None:
+            with open(root + FIXED_SUFFIX + STAMP_SUFFIX, "w", encoding="utf-8") as f:
+                f.write(stamp)
+
+
+def fetch_openwrt(configs: dict[str, dict[str, Any]]) -> str:
+    logger.info("开始获取openwrt源码...")
+    # 只获取配置中用到的分支与标签的最新提交到一个裸仓库, 每个配置使用共享对象库的工作树
+    store = pygit2.init_repository(os.path.join(paths.workdir, "openwrt.git"), bare=True)
+    url = "https://github.com/openwrt/openwrt"
+    # 裸仓库可能已经存在(例如重复运行), 此时复用已有的origin
+    if "origin" in store.remotes.names():
+        store.remotes.set_url("origin", url)
+    else:
+        store.remotes.create("origin", url)
+    fetch_refs(store, [config["compile"]["openwrt_tag/branch"] for config in configs.values()])
+    os.makedirs(os.path.join(paths.workdir, "openwrts"), exist_ok=True)
+    return store.path
+
+
+def prepare_files(global_files_path: str) -> None:
     # 下载AdGuardHome规则与配置
     logger.info("下载AdGuardHome规则与配置...")
-    global_files_path = os.path.join(paths.workdir, "files")
     shutil.copytree(os.path.join(paths.openwrt_k, "files"), global_files_path, symlinks=True)
     adg_filters_path = os.path.join(global_files_path, "usr", "bin", "AdGuardHome", "data", "filters")
     os.makedirs(adg_filters_path, exist_ok=True)
@@ -191,28 +218,118 @@ def prepare(configs: dict[str, dict[str, Any]]) -> None:
 
     wait_dl_tasks(dl_tasks)
 
-    # 获取用户信息
+
+def log_compiler() -> str:
+    compiler = get_compiler()
     logger.info("编译者：%s", compiler)
+    return compiler
+
 
-    tasks = []
-    for cfg_name, openwrt in openwrts.items():
-        config = configs[cfg_name]
-        tasks.append((config, cfg_name, openwrt, cloned_repos, global_files_path))
-    with Pool(len(cfg_names)) as p:
-        for cfg_name, config, tar_path in p.starmap(prepare_cfg, tasks):
+def prepare(configs: dict[str, dict[str, Any]]) -> None:
+    # 需要完整检出的仓库
+    full: set[tuple[str, str]] = {("https://github.com/chenmozhijin/turboacc", "package"),
+                                  ("https://github.com/pymumu/openwrt-smartdns", "master"),
+                                  ("https://github.com/pymumu/luci-app-smartdns", "master"),
+                                  *[("https://github.com/sbwml/packages_lang_golang",
+                                     config["openwrtext"]["golang_version"]) for config in configs.values()]}
+    # 只需要检出部分目录的仓库, 拓展软件包只检出配置中用到的目录
+    sparse: dict[tuple[str, str], set[str]] = {("https://github.com/immortalwrt/packages", ""): {"admin/netdata"}}
+    for config in configs.values():
+        for pkg in config["extpackages"].values():
+            pair = (pkg["REPOSITORIE"], pkg["BRANCH"])
+            if pkg["PATH"].strip("/") in ("", "."):
+                full.add(pair)
+            else:
+                sparse.setdefault(pair, set()).add(pkg["PATH"].strip("/"))
+    to_clone = full | sparse.keys()
+
+    checkouts: dict[str, list[tuple[str, str, set[str] | None]]] = {}
+    cloned_repos: dict[tuple[str, str | None], str] = {}
+    for repo, branch in to_clone:
+        path = os.path.join(paths.workdir, "repos", repo.split("/")[-2], repo.split("/")[-1], branch if branch else "@default@")
+        checkouts.setdefault(repo, []).append((branch, path, None if (repo, branch) in full else sparse[(repo, branch)]))
+        cloned_repos[(repo, branch)] = path
+    cfg_names = list(configs.keys())
+    global_files_path = os.path.join(paths.workdir, "files")
+    openwrts: dict[str, OpenWrt] = {}
+
+    # 缓存中在这之后没有用到的条目会在结束时删除
+    start_time = time.time()
+    # 彼此独立的步骤(克隆拓展软件源码、获取openwrt源码、下载文件)同时进行, 每个配置在其依赖完成后立即开始处理
+    graph = TaskGraph()
+    repo_tasks = []
+    for repo, repo_checkouts in checkouts.items():
+        # 检出失败时连同标识文件一起删除, 否则之后检出的未处理内容会被误认为已经处理过
+        cleanup = [p for _, path, _ in repo_checkouts for p in (path, *GitMirror.stamp_paths(path, (FIXED_SUFFIX,)))]
+        clone_task = graph.add(f"clone:{repo}", clone, repo, repo_checkouts, cleanup=cleanup)
+        ext_pkg_paths: dict[str, set[str]] = {}
+        for config in configs.values():
+            for pkg in config["extpackages"].values():
+                if pkg["REPOSITORIE"] == repo:
+                    root = cloned_repos[(pkg["REPOSITORIE"], pkg["BRANCH"])]
+                    ext_pkg_paths.setdefault(root, set()).add(os.path.join(root, pkg["PATH"]))
+        repo_tasks.append(graph.add(f"fix:{repo}", fix_ext_packages, ext_pkg_paths, deps=[clone_task]) if ext_pkg_paths else clone_task)
+    fetch_task = graph.add("fetch:openwrt", fetch_openwrt, configs)
+    files_task = graph.add("files", prepare_files, global_files_path, cleanup=[global_files_path])
+    # 获取用户信息, 在主进程中只请求一次, 结果传给各配置的处理进程
+    compiler_task = graph.add("compiler", log_compiler)
+    # AdGuardHome与OpenClash核心的版本只获取一次
+    cores_task = graph.add("cores", get_core_versions)
+
+    def add_worktree(name: str) -> None:
+        # pygit2的Repository对象不能在线程间共享, 每个线程单独打开对象库
+        store = pygit2.Repository(fetch_task.result)
+        openwrts[name] = OpenWrt.from_store(store, name, os.path.join(paths.workdir, "openwrts", name), configs[name]["compile"]["openwrt_tag/branch"])
+
+    def update_feeds(name: str) -> None:
+        logger.info("%s开始更新feeds...", name)
+        get_feeds_cache().update(openwrts[name])
+
+    # prepare_cfg在子进程中运行, 进程池在启动其他线程前创建, 任务组取消时终止进程池(连同工作进程启动的子进程)
+    with Pool(len(cfg_names), initializer=init_worker) as p:
+        graph.group.add_callback(p.terminate)
+
+        def run_prepare_cfg(name: str) -> None:
+            args = (configs[name], name, openwrts[name], cloned_repos, global_files_path, compiler_task.result, cores_task.result)
+            result = p.apply_async(prepare_cfg, args)
+            while not result.ready():
+                graph.group.check()
+                result.wait(1)
+            cfg_name, config, tar_path = result.get()
             configs[cfg_name] = config
             uploader.add(f"openwrt-source-{cfg_name}", tar_path,retention_days=1,compression_level=0)
             logger.info("%s处理完成", cfg_name)
 
+        for name in cfg_names:
+            worktree_task = graph.add(f"worktree:{name}", add_worktree, name, deps=[fetch_task],
+                                      cleanup=[os.path.join(paths.workdir, "openwrts", name)])
+            feeds_task = graph.add(f"feeds:{name}", update_feeds, name, deps=[worktree_task])
+            graph.add(f"prepare:{name}", run_prepare_cfg, name, deps=[feeds_task, files_task, compiler_task, cores_task, *repo_tasks])
+        try:
+            graph.run()
+        finally:
+            graph.report()
+
+    # 本次运行结束后会保存新的git镜像、feeds与核心缓存
+    get_feeds_cache().prune()
+    prune_cores(start_time)
+    prune_snapshots(start_time)
+    logger.info("删除旧的git镜像、feeds、核心与HTTP缓存...")
+    del_cache(GIT_MIRROR_CACHE_PREFIX)
+    del_cache(FEEDS_CACHE_PREFIX)
+    del_cache(CORE_CACHE_PREFIX)
+    del_cache(HTTP_CACHE_PREFIX)
+    # 仓库缓存总大小的预算只在这里统一检查一次
+    trim_caches()
+
 
 def prepare_cfg(config: dict[str, Any],
                 cfg_name: str,
                 openwrt: OpenWrt,
                 cloned_repos: dict[tuple[str, str], str],
-                global_files_path: str) -> tuple[str, dict[str, Any], str]:
-
-    logger.info("%s开始更新feeds...", cfg_name)
-    openwrt.feed_update()
+                global_files_path: str,
+                compiler: str,
+                core_versions: dict[str, Any]) -> tuple[str, dict[str, Any], str]:
 
     logger.info("%s开始更新netdata、smartdns...", cfg_name)
     # 更新netdata
@@ -254,11 +371,11 @@ def prepare_cfg(config: dict[str, Any],
     # 添加turboacc补丁
     turboacc_dir = os.path.join(cloned_repos[("https://github.com/chenmozhijin/turboacc", "package")])
     kernel_version = openwrt.get_kernel_version()
-    enable_sfe = (openwrt.get_package_config("kmod-shortcut-fe") in ("y", "m") or
-               openwrt.get_package_config("kmod-shortcut-fe-drv") in ("y", "m") or
-               openwrt.get_package_config("kmod-shortcut-fe-cm") in ("y", "m") or
-               openwrt.get_package_config("kmod-fast-classifier") in ("y", "m"))
-    enable_fullcone = openwrt.get_package_config("kmod-nft-fullcone") in ("y", "m")
+    package_configs = openwrt.get_package_configs(("kmod-shortcut-fe", "kmod-shortcut-fe-drv", "kmod-shortcut-fe-cm", "kmod-fast-classifier",
+                                                   "kmod-nft-fullcone", "luci-app-adguardhome", "luci-app-openclash"))
+    enable_sfe = any(package_configs[package] in ("y", "m")
+                     for package in ("kmod-shortcut-fe", "kmod-shortcut-fe-drv", "kmod-shortcut-fe-cm", "kmod-fast-classifier"))
+    enable_fullcone = package_configs["kmod-nft-fullcone"] in ("y", "m")
     if enable_fullcone or enable_sfe:
         logger.info("%s添加952补丁", cfg_name)
         patch925 = f"952{"-add" if kernel_version != "5.10" else ""}-net-conntrack-events-support-multiple-registrant.patch"
@@ -342,63 +459,17 @@ def prepare_cfg(config: dict[str, Any],
         case _:
             adg_arch, clash_arch = None, None
 
-    tmpdir = paths.get_tmpdir()
-    dl_tasks: list[DLTask] = []
-    if adg_arch and openwrt.get_package_config("luci-app-adguardhome") == "y":
-        logger.info("%s下载架构为%s的AdGuardHome核心", cfg_name, adg_arch)
-        releases = get_gh_repo_last_releases("AdguardTeam/AdGuardHome")
-        if releases:
-            for asset in releases["assets"]:
-                if asset["name"] == f"AdGuardHome_linux_{adg_arch}.tar.gz":
-                    dl_tasks.append(dl2(asset["browser_download_url"], os.path.join(tmpdir.name, "AdGuardHome.tar.gz")))
-                    break
-            else:
-                logger.error("未找到可用的AdGuardHome二进制文件")
-
-    if clash_arch and openwrt.get_package_config("luci-app-openclash") == "y":
-        logger.info("%s下载架构为%s的OpenClash核心", cfg_name, clash_arch)
-        latest_versions = request_get("https://raw.githubusercontent.com/vernesong/OpenClash/core/master/core_version")
-        tun_v = latest_versions.splitlines()[1] if latest_versions else None
-        if tun_v:
-            dl_tasks.append(dl2(f"https://raw.githubusercontent.com/vernesong/OpenClash/core/master/premium/clash-{clash_arch}-{tun_v}.gz",
-                                os.path.join(tmpdir.name, "clash_tun.gz")))
-        dl_tasks.append(dl2(f"https://raw.githubusercontent.com/vernesong/OpenClash/core/master/meta/clash-{clash_arch}.tar.gz",
-                                os.path.join(tmpdir.name, "clash_meta.tar.gz")))
-        dl_tasks.append(dl2(f"https://raw.githubusercontent.com/vernesong/OpenClash/core/master/dev/clash-{clash_arch}.tar.gz",
-                                os.path.join(tmpdir.name, "clash.tar.gz")))
-
-    wait_dl_tasks(dl_tasks)
-    # 解压
-    if os.path.isfile(os.path.join(tmpdir.name, "AdGuardHome.tar.gz")):
-        with tarfile.open(os.path.join(tmpdir.name, "AdGuardHome.tar.gz"), "r:gz") as tar:
-            if file := tar.extractfile("./AdGuardHome/AdGuardHome"):
-                with open(os.path.join(files_path, "usr", "bin", "AdGuardHome", "AdGuardHome"), "wb") as f:
-                    f.write(file.read())
-                os.chmod(os.path.join(files_path, "usr", "bin", "AdGuardHome", "AdGuardHome"), 0o755)  # noqa: S103
+    if adg_arch and package_configs["luci-app-adguardhome"] == "y" and core_versions["AdGuardHome"]:
+        logger.info("%s获取架构为%s的AdGuardHome核心", cfg_name, adg_arch)
+        if adg_path := get_adguardhome(core_versions["AdGuardHome"], adg_arch):
+            shutil.copy2(os.path.join(adg_path, "AdGuardHome"), os.path.join(files_path, "usr", "bin", "AdGuardHome", "AdGuardHome"))
 
     clash_core_path = os.path.join(files_path, "etc", "openclash", "core")
     if not os.path.isdir(clash_core_path):
         os.makedirs(clash_core_path)
-    if os.path.isfile(os.path.join(tmpdir.name, "clash_tun.gz")):
-        with gzip.open(os.path.join(tmpdir.name, "clash_tun.gz"), 'rb') as f_in, open(os.path.join(clash_core_path, "clash_tun"), 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        os.chmod(os.path.join(clash_core_path, "clash_tun"), 0o755)  # noqa: S103
-
-    if os.path.isfile(os.path.join(tmpdir.name, "clash_meta.tar.gz")):
-        with tarfile.open(os.path.join(tmpdir.name, "clash_meta.tar.gz"), "r:gz") as tar:
-            if file := tar.extractfile("clash"):
-                with open(os.path.join(clash_core_path, "clash_meta"), "wb") as f:
-                    f.write(file.read())
-                os.chmod(os.path.join(clash_core_path, "clash_meta"), 0o755)  # noqa: S103
-
-    if os.path.isfile(os.path.join(tmpdir.name, "clash.tar.gz")):
-        with tarfile.open(os.path.join(tmpdir.name, "clash.tar.gz"), "r:gz") as tar:
-            if file := tar.extractfile("clash"):
-                with open(os.path.join(clash_core_path, "clash"), "wb") as f:
-                    f.write(file.read())
-                os.chmod(os.path.join(clash_core_path, "clash"), 0o755)  # noqa: S103
-
-    tmpdir.cleanup()
+    if clash_arch and package_configs["luci-app-openclash"] == "y":
+        logger.info("%s获取架构为%s的OpenClash核心", cfg_name, clash_arch)
+        install_openclash(core_versions["OpenClash"], clash_arch, clash_core_path)
 
     # 获取bt_trackers
     bt_tracker = request_get("https://github.com/XIU2/TrackersListCollection/raw/master/all_aria2.txt")
@@ -436,13 +507,13 @@ def prepare_cfg(config: dict[str, Any],
         content = ""
         content += f'COMPILE_START_TIME="{datetime.now(timezone(timedelta(hours=8))).strftime('%y.%m.%d-%H')}"\n'
         content += f'COMPILER="{compiler}"\n'
-        content += f'REPOSITORY_URL="https://github.com/{user_repo}"\n'
+        content += f'REPOSITORY_URL="https://github.com/{get_user_repo()}"\n'
         content += f'TAG_SUFFIX="{get_release_suffix(config)[1]}"\n'
         f.write(content)
     logger.debug("openwrt-k_info: %s", content)
 
     logger.info("%s生成源代码归档", cfg_name)
-    shutil.rmtree(os.path.join(openwrt.path, ".git"))
+    openwrt.remove_git()
     os.makedirs(os.path.join(paths.uploads, cfg_name), exist_ok=True)
     tar_path = os.path.join(paths.uploads, cfg_name, "openwrt-source.tar.gz")
     openwrt.archive(tar_path)
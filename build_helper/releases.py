@@ -11,7 +11,7 @@ from .utils.logger import logger
 from .utils.network import request_get
 from .utils.openwrt import ImageBuilder, OpenWrt
 from .utils.paths import paths
-from .utils.repo import dl_artifact, get_current_commit, match_releases, new_release, repo, user_repo
+from .utils.repo import dl_artifact, get_current_commit, get_repo, get_user_repo, match_releases, new_release
 
 
 def releases(cfg: dict) -> None:
@@ -80,7 +80,7 @@ def releases(cfg: dict) -> None:
                 for pkg_name, version in current_packages.items():
                     pkg = packages.get(pkg_name)
                     if pkg_name in old_packages:
-                        if old_packages[pkg_name] != version and pkg and pkg["version"] != "x":
+                        if old_packages[pkg_name] != version and pkg and pkg.version != "x":
                             changelog += f"更新: {pkg_name} {old_packages[pkg_name]} -> {version}\n"
                     else:
                         changelog += f"新增: {pkg_name} {version}\n"
@@ -91,8 +91,8 @@ def releases(cfg: dict) -> None:
             changelog = "更新日志:\n" + changelog if changelog else "无任何软件包更新"
 
         body = f"编译完成于: {datetime.now(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S')}\n"
-        body += f"使用的配置: [{cfg['name']}](https://github.com/{user_repo}/tree/{get_current_commit()}/config/{cfg['name']})\n"
-        workflow_run = repo.get_workflow_run(context.run_id)
+        body += f"使用的配置: [{cfg['name']}](https://github.com/{get_user_repo()}/tree/{get_current_commit()}/config/{cfg['name']})\n"
+        workflow_run = get_repo().get_workflow_run(context.run_id)
         body += f"编译此固件的工作流运行: [{workflow_run.display_title}]({workflow_run.html_url}) ({workflow_run.event})\n"
         if profiles:
             if (version_number := profiles.get("version_number")) and (version_code := profiles.get('version_code')):
@@ -0,0 +1,13 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+# 运行: python -m unittest discover -s build_helper/tests -t .
+import os
+import tempfile
+
+# 测试使用临时的工作区, 需要在导入build_helper的其他模块前设置
+os.environ["GITHUB_WORKSPACE"] = tempfile.mkdtemp(prefix="build_helper-tests-")
+
+from build_helper.utils.paths import paths
+
+# 日志写到临时工作区, 不写到unittest所在的目录
+paths.build_helper = paths.root
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from build_helper.utils.cores import CoreCache, extract_tar_member
+
+
+class CoreCacheTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = CoreCache(os.path.join(self.tmpdir, "cores"))
+        self.archive = os.path.join(self.tmpdir, "core.tar.gz")
+        with tarfile.open(self.archive, "w:gz") as tar:
+            info = tarfile.TarInfo("other")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"data"))
+
+    def test_failed_fetch_is_not_cached(self) -> None:
+        def fetch(path: str) -> None:
+            if not extract_tar_member(self.archive, "clash", os.path.join(path, "clash")):
+                msg = "missing clash"
+                raise FileNotFoundError(msg)
+
+        with self.assertRaises(FileNotFoundError):
+            self.cache.get("OpenClash", "clash-v1", "amd64", fetch)
+        self.assertFalse(os.path.exists(self.cache.get_path("OpenClash", "clash-v1", "amd64")))
+        self.assertEqual(os.listdir(os.path.dirname(self.cache.get_path("OpenClash", "clash-v1", "amd64"))), ["amd64.lock"])
+
+    def test_fetch_once(self) -> None:
+        calls = []
+
+        def fetch(path: str) -> None:
+            calls.append(path)
+            extract_tar_member(self.archive, "other", os.path.join(path, "other"))
+
+        for _ in range(2):
+            path = self.cache.get("OpenClash", "clash-v1", "amd64", fetch)
+            with open(os.path.join(path, "other"), "rb") as f:
+                self.assertEqual(f.read(), b"data")
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import sys
+import unittest
+
+from build_helper.utils.depgraph import DependencyGraph, evaluate_condition, parse_depends
+from build_helper.utils.metadata import PackageInfo
+
+
+def make_graph(depends: dict[str, str | None], provides: dict[str, str] | None = None) -> DependencyGraph:
+    packages = {}
+    for name, value in depends.items():
+        packages[name] = PackageInfo(name, None)
+        packages[name].depends = value
+        packages[name].provides = (provides or {}).get(name)
+    return DependencyGraph(packages)
+
+
+class ParseDependsTestCase(unittest.TestCase):
+
+    def test_parse(self) -> None:
+        dependencies, symbols = parse_depends("+libc +USE_GLIBC:libpthread kmod-bar @TARGET_x86 @(A||B) +(A&&!B):libfoo +libbar ($(X))")
+        self.assertEqual([repr(dependency) for dependency in dependencies],
+                         ["+libc", "+USE_GLIBC:libpthread", "kmod-bar", "+(A&&!B):libfoo", "+libbar"])
+        self.assertEqual([dependency.select for dependency in dependencies], [True, True, False, True, True])
+        self.assertEqual(symbols, ["TARGET_x86", "(A||B)"])
+
+    def test_empty(self) -> None:
+        self.assertEqual(parse_depends(None), ([], []))
+
+
+class EvaluateConditionTestCase(unittest.TestCase):
+
+    def test_evaluate(self) -> None:
+        symbols = {"A": "y", "B": "n", "C": "m"}
+        self.assertTrue(evaluate_condition("A", symbols))
+        self.assertFalse(evaluate_condition("B", symbols))
+        self.assertFalse(evaluate_condition("UNSET", symbols))
+        self.assertTrue(evaluate_condition("!B", symbols))
+        self.assertTrue(evaluate_condition("(A||B)&&C", symbols))
+        self.assertFalse(evaluate_condition("A&&!(B||C)", symbols))
+        self.assertTrue(evaluate_condition("B||A&&C", symbols))
+
+    def test_unknown(self) -> None:
+        for condition in ("A=y", "(A||B", "A||", "A)"):
+            self.assertIsNone(evaluate_condition(condition, {}))
+
+
+class DependencyGraphTestCase(unittest.TestCase):
+
+    def test_virtual_and_queries(self) -> None:
+        graph = make_graph({"app": "+libssl +kmod-x", "openssl": "+libc", "wolfssl": "+libc", "libc": None, "kmod-x": None},
+                           {"openssl": "libssl", "wolfssl": "libssl"})
+        self.assertEqual(graph.resolve("libssl"), {"openssl", "wolfssl"})
+        self.assertEqual(graph.get_dependencies("app"), {"openssl", "wolfssl", "kmod-x"})
+        self.assertEqual(graph.get_dependencies("app", recursive=True), {"openssl", "wolfssl", "kmod-x", "libc"})
+        self.assertEqual(graph.get_dependents("libc", recursive=True), {"openssl", "wolfssl", "app"})
+        self.assertEqual(graph.explain("libc", ["app"]), ["app", "openssl", "libc"])
+        self.assertIsNone(graph.explain("app", ["libc"]))
+
+    def test_find_missing(self) -> None:
+        graph = make_graph({"a": "+missing +USE_X:only-x +!USE_X:not-x +(USE_X||USE_Y):xy +(A=y):cmp +libc", "libc": None})
+        missing = graph.find_missing(symbols={"USE_X": "n", "USE_Y": "y"})
+        # 条件确定成立的缺失依赖才报告, 无法判断的条件(A=y)不报告
+        self.assertEqual([repr(dependency) for dependency in missing["a"]], ["+missing", "+!USE_X:not-x", "+(USE_X||USE_Y):xy"])
+        # 没有.config时所有条件视为成立
+        self.assertEqual(len(graph.find_missing()["a"]), 5)
+        self.assertEqual(graph.find_missing(["libc"]), {})
+
+    def test_find_cycles(self) -> None:
+        graph = make_graph({"a": "b", "b": "c", "c": "a", "d": "d", "e": "a", "f": None})
+        self.assertEqual(sorted(graph.find_cycles()), [["a", "b", "c"], ["d"]])
+        self.assertEqual(graph.find_cycles(["a", "b", "e"]), [])
+
+    def test_find_cycles_deep(self) -> None:
+        # 远超递归深度限制的依赖链, 验证非递归实现
+        count = sys.getrecursionlimit() * 2
+        depends: dict[str, str | None] = {f"p{i}": f"p{i + 1}" for i in range(count)}
+        depends[f"p{count}"] = "p0"
+        depends["tail"] = "p0"
+        cycles = make_graph(depends).find_cycles()
+        self.assertEqual(len(cycles), 1)
+        self.assertEqual(len(cycles[0]), count + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+
+from build_helper.utils.cache import HTTPCache
+from build_helper.utils.downloader import DLTask, DLVerifier, IntegrityError, wait_dl_tasks
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """完整请求返回截断的内容(Content-Length与截断后的长度一致), 分片请求正常返回"""
+
+    protocol_version = "HTTP/1.1"
+    truncate_at = 1024 * 1024
+    ranges: ClassVar[list[str]] = []
+    whole_requests = 0
+
+    def log_message(self, *_args: object) -> None:
+        pass
+
+    def send(self, status: int, body: bytes, headers: dict[str, str]) -> None:
+        self.send_response(status)
+        for key, value in {**headers, "ETag": ETAG, "Content-Length": str(len(body))}.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        rng = self.headers.get("Range")
+        if rng is None or self.headers.get("If-Range", ETAG) != ETAG:
+            type(self).whole_requests += 1
+            self.send(200, DATA[:self.truncate_at], {})
+            return
+        type(self).ranges.append(rng)
+        match = re.match(r"bytes=(\d+)-(\d*)", rng)
+        if match is None:
+            self.send(416, b"", {})
+            return
+        start, end = int(match.group(1)), min(int(match.group(2) or len(DATA) - 1), len(DATA) - 1)
+        self.send(206, DATA[start:end + 1], {"Content-Range": f"bytes {start}-{end}/{len(DATA)}"})
+
+
+class DownloaderTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        Handler.ranges = []
+        Handler.whole_requests = 0
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = HTTPCache(os.path.join(self.tmpdir, "cache"))
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/{name}"
+
+    def download(self, name: str, sha256: str | None, size: int | None) -> DLTask:
+        url = self.url(name)
+        # 缓存中有旧版本, 条件请求返回200与截断的新内容
+        self.cache.put_bytes(url, b"old", '"v0"', None)
+        task = DLTask(url, os.path.join(self.tmpdir, name), 1, None, None, cache=self.cache, sha256=sha256, size=size)
+        wait_dl_tasks([task])
+        return task
+
+    def test_size_mismatch_refetches_missing_range(self) -> None:
+        task = self.download("short", hashlib.sha256(DATA).hexdigest(), len(DATA))
+        with open(task.path, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(Handler.whole_requests, 1)
+        self.assertEqual(Handler.ranges, [f"bytes={Handler.truncate_at}-{len(DATA) - 1}"])
+        self.assertFalse(os.path.exists(task.journal.path))
+
+    def test_digest_mismatch_raises(self) -> None:
+        # sha256不符时无法定位出错的区间, 重新下载整个文件一次后报错
+        with self.assertRaises(IntegrityError):
+            self.download("digest", "0" * 64, None)
+        self.assertEqual(Handler.whole_requests, 1)
+        # 第二次从开头的探测请求开始重新下载
+        self.assertTrue(Handler.ranges[0].startswith("bytes=0-"))
+
+
+class DLVerifierTestCase(unittest.TestCase):
+
+    def test_missing(self) -> None:
+        verifier = DLVerifier(None, 100)
+        verifier.update(None, 0, b"x" * 10)
+        verifier.mark(20, 30)
+        verifier.mark(30, 40)
+        self.assertEqual(verifier.missing(), [(10, 19), (40, 99)])
+
+    def test_missing_unknown(self) -> None:
+        # 大小正确或超出预期时无法定位
+        verifier = DLVerifier(None, 10)
+        verifier.update(None, 0, b"x" * 10)
+        self.assertIsNone(verifier.missing())
+        verifier = DLVerifier(None, 10)
+        verifier.mark(5, 20)
+        self.assertIsNone(verifier.missing())
+        self.assertIsNone(DLVerifier("0" * 64, None).missing())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+import tempfile
+import time
+import unittest
+
+from build_helper.utils import metadata
+
+
+def parse_lines(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, ".packageinfo")
+        with open(self.source, "w", encoding="utf-8") as f:
+            f.write("a\nb\n")
+        self.snapshot_dir = metadata.get_snapshot_dir()
+        for name in os.listdir(self.snapshot_dir):
+            os.remove(os.path.join(self.snapshot_dir, name))
+
+    def test_prune_keeps_used_snapshots(self) -> None:
+        self.assertEqual(metadata.load_cached(self.source, parse_lines), ["a", "b"])
+        [snapshot] = os.listdir(self.snapshot_dir)
+        stale = os.path.join(self.snapshot_dir, "parse_lines-stale.pickle")
+        with open(stale, "wb"):
+            pass
+        old = time.time() - 3600
+        for name in (snapshot, "parse_lines-stale.pickle"):
+            os.utime(os.path.join(self.snapshot_dir, name), (old, old))
+
+        since = time.time() - 60
+        # 其他进程(没有内存缓存)读取快照时更新修改时间
+        metadata._loaded.clear()
+        self.assertEqual(metadata.load_cached(self.source, parse_lines), ["a", "b"])
+        metadata.prune_snapshots(since)
+        self.assertEqual(os.listdir(self.snapshot_dir), [snapshot])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygit2
+
+from build_helper.utils.mirror import GitMirror
+
+
+class LocalMirror(GitMirror):
+    """本地传输不支持浅获取, 测试中完整获取本地仓库"""
+
+    def fetch(self, repo: pygit2.Repository, url: str, branch: str | None) -> pygit2.Commit:  # noqa: ARG002
+        repo.remotes["origin"].fetch([f"+refs/heads/{branch}:refs/remotes/origin/{branch}"])
+        return repo.references[f"refs/remotes/origin/{branch}"].peel(pygit2.Commit)
+
+
+class CheckoutTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        source = pygit2.init_repository(os.path.join(self.tmpdir, "source"), bare=True)
+        blob = source.create_blob(b"include ../../luci.mk\n")
+        builder = source.TreeBuilder()
+        builder.insert("Makefile", blob, pygit2.GIT_FILEMODE_BLOB)
+        signature = pygit2.Signature("test", "test@example.com")
+        source.create_commit("refs/heads/master", signature, signature, "init", builder.write(), [])
+        self.url = "file://" + source.path.rstrip("/")
+        self.mirror = LocalMirror(os.path.join(self.tmpdir, "mirrors"))
+        self.path = os.path.join(self.tmpdir, "repos", "pkg", "master")
+
+    def write_fixed_stamp(self, stamp: str) -> str:
+        fixed_stamp = GitMirror.stamp_paths(self.path, (".fixed",))[1]
+        with open(fixed_stamp, "w", encoding="utf-8") as f:
+            f.write(stamp)
+        return fixed_stamp
+
+    def test_unchanged_checkout_keeps_derived_stamp(self) -> None:
+        stamp = self.mirror.checkout(self.url, "master", self.path, derived=(".fixed",))
+        fixed_stamp = self.write_fixed_stamp(stamp)
+        self.assertEqual(self.mirror.checkout(self.url, "master", self.path, derived=(".fixed",)), stamp)
+        self.assertTrue(os.path.exists(fixed_stamp))
+
+    def test_new_checkout_removes_derived_stamp(self) -> None:
+        # 检出目录被删除后重新检出的是未处理的内容, 树对象id相同也不能沿用处理标识
+        stamp = self.mirror.checkout(self.url, "master", self.path, derived=(".fixed",))
+        fixed_stamp = self.write_fixed_stamp(stamp)
+        shutil.rmtree(self.path)
+        self.assertEqual(self.mirror.checkout(self.url, "master", self.path, derived=(".fixed",)), stamp)
+        self.assertFalse(os.path.exists(fixed_stamp))
+        self.assertEqual(GitMirror.read_stamp(self.path), stamp)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygit2
+
+from build_helper.utils.metadata import PackageInfo, TargetInfo
+from build_helper.utils.openwrt import OpenWrt
+
+
+class FromStoreTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = pygit2.init_repository(os.path.join(self.tmpdir, "openwrt.git"), bare=True)
+        blob = self.store.create_blob(b"hello\n")
+        builder = self.store.TreeBuilder()
+        builder.insert("README", blob, pygit2.GIT_FILEMODE_BLOB)
+        signature = pygit2.Signature("test", "test@example.com")
+        self.store.create_commit("refs/heads/main", signature, signature, "init", builder.write(), [])
+        os.makedirs(os.path.join(self.tmpdir, "openwrts"))
+        self.path = os.path.join(self.tmpdir, "openwrts", "x86_64")
+
+    def test_rerun(self) -> None:
+        # 第二次运行时上次的工作树记录与目录仍然存在(remove_git只删除工作树中的.git文件)
+        for _ in range(2):
+            openwrt = OpenWrt.from_store(self.store, "x86_64", self.path, "main")
+            with open(os.path.join(self.path, "README"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "hello\n")
+            openwrt.remove_git()
+        self.assertEqual(self.store.list_worktrees(), ["x86_64"])
+
+    def test_rerun_after_cleanup(self) -> None:
+        # 任务失败后工作树目录被整个删除, 只留下对象库中的记录
+        OpenWrt.from_store(self.store, "x86_64", self.path, "main")
+        shutil.rmtree(self.path)
+        openwrt = OpenWrt.from_store(self.store, "x86_64", self.path, "main")
+        self.assertIsNotNone(openwrt.repo)
+
+
+class FakeOpenWrt(OpenWrt):
+    """make defconfig总是把kmod-b改回n(依赖不满足), 启用kmod-a后kmod-c才可见"""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.defconfigs = 0
+
+    def get_packageinfos(self) -> dict[str, PackageInfo]:
+        packages = {}
+        for name in ("kmod-a", "kmod-b", "kmod-c", "kmod-x"):
+            packages[name] = PackageInfo(name, None)
+            packages[name].section = "kernel"
+        return packages
+
+    def get_targetinfo(self) -> TargetInfo | None:
+        return None
+
+    def get_diff_config(self) -> str:
+        return ""
+
+    def make_defconfig(self) -> None:
+        self.defconfigs += 1
+        with open(self.config_path, encoding="utf-8") as f:
+            config = f.read().replace("CONFIG_PACKAGE_kmod-b=m", "# CONFIG_PACKAGE_kmod-b is not set")
+        if "CONFIG_PACKAGE_kmod-a=m" in config and "kmod-c" not in config:
+            config += "# CONFIG_PACKAGE_kmod-c is not set\n"
+        with open(self.config_path, "w", encoding="utf-8") as f:
+            f.write(config)
+
+
+class EnableKmodsTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.openwrt = FakeOpenWrt(tempfile.mkdtemp())
+        with open(self.openwrt.config_path, "w", encoding="utf-8") as f:
+            f.write("# CONFIG_PACKAGE_kmod-a is not set\n# CONFIG_PACKAGE_kmod-b is not set\n# CONFIG_PACKAGE_kmod-x is not set\n")
+
+    def symbols(self) -> dict[str, str]:
+        index = self.openwrt.get_config_index()
+        self.assertIsNotNone(index)
+        return {name: value for name, value in index.symbols.items() if name.startswith("PACKAGE_")} if index else {}
+
+    def test_enable(self) -> None:
+        # 第1轮启用a(b被改回), 第2轮启用新出现的c并重试b, 第3轮只重试b, 配置不再变化后停止
+        passes = self.openwrt.enable_kmods(["kmod-x"])
+        self.assertEqual(self.symbols(), {"PACKAGE_kmod-a": "m", "PACKAGE_kmod-b": "n", "PACKAGE_kmod-x": "n", "PACKAGE_kmod-c": "m"})
+        self.assertEqual(passes, 3)
+        self.assertEqual(self.openwrt.defconfigs, 3)
+
+    def test_empty_exclude_list(self) -> None:
+        # 空的排除列表匹配所有kmod
+        self.assertEqual(self.openwrt.enable_kmods([]), 0)
+        self.assertEqual(set(self.symbols().values()), {"n"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import unittest
+
+from build_helper.utils.repo import _select_caches, _select_over_budget
+
+
+def cache(cache_id: int, key: str, size: int = 1, created: str = "", accessed: str = "") -> dict:
+    return {"id": cache_id, "key": key, "size_in_bytes": size, "created_at": created, "last_accessed_at": accessed}
+
+
+class SelectCachesTestCase(unittest.TestCase):
+
+    def test_only_matching_prefix(self) -> None:
+        caches = [cache(1, "feeds-1", created="1"), cache(2, "feeds-2", created="2"), cache(3, "x86_64-ccache", created="0")]
+        self.assertEqual([c["id"] for c in _select_caches(caches, "feeds-", 0)], [2, 1])
+
+    def test_keep_newest(self) -> None:
+        caches = [cache(1, "feeds-1", created="1"), cache(2, "feeds-2", created="3"), cache(3, "feeds-3", created="2")]
+        self.assertEqual([c["id"] for c in _select_caches(caches, "feeds-", 1)], [3, 1])
+
+    def test_ignores_size(self) -> None:
+        # 按前缀清理时不会为了空间预算删除其他配置的缓存
+        caches = [cache(1, "feeds-1"), cache(2, "x86_64-ccache", size=100 * 1000 ** 3)]
+        self.assertEqual(_select_caches(caches, "feeds-", 1), [])
+
+
+class SelectOverBudgetTestCase(unittest.TestCase):
+
+    def test_under_budget(self) -> None:
+        self.assertEqual(_select_over_budget([cache(1, "a", size=5), cache(2, "b", size=5)], 10), [])
+
+    def test_lru_and_toolchain_last(self) -> None:
+        caches = [cache(1, "toolchain-x86", size=4, accessed="1"),
+                  cache(2, "x86-ccache", size=4, accessed="3"),
+                  cache(3, "rpi-ccache", size=4, accessed="2"),
+                  cache(4, "toolchain-rpi", size=4, accessed="0")]
+        self.assertEqual([c["id"] for c in _select_over_budget(caches, 8)], [3, 2])
+        self.assertEqual([c["id"] for c in _select_over_budget(caches, 3)], [3, 2, 4, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
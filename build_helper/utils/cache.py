@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from .logger import logger
+from .paths import paths
+
+# HTTP缓存的最大占用空间
+HTTP_CACHE_MAX_SIZE = 2 * 1024 ** 3
+# Actions缓存中HTTP与GitHub API缓存目录的键前缀
+HTTP_CACHE_PREFIX = "http-cache-"
+
+
+class HTTPCache:
+    """以URL为键的本地HTTP缓存, 通过ETag/Last-Modified进行条件请求验证, 超出空间预算时按LRU淘汰
+
+    每个条目由内容文件与元数据文件组成, 写入时先写临时文件再替换, 可以被多个进程同时使用。
+    """
+
+    def __init__(self, path: str, max_size: int = HTTP_CACHE_MAX_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry(self, url: str) -> tuple[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key), os.path.join(self.path, key + ".json")
+
+    def _write_meta(self, meta_path: str, meta: dict) -> None:
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def get(self, url: str) -> dict | None:
+        """获取缓存条目的元数据, 内容文件缺失或大小不符时丢弃该条目"""
+        body_path, meta_path = self._entry(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["url"] == url and os.path.getsize(body_path) == meta["size"]:
+                return meta
+        except (OSError, ValueError, KeyError):
+            pass
+        self.remove(url)
+        return None
+
+    @staticmethod
+    def conditional_headers(meta: dict) -> dict[str, str]:
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def touch(self, url: str) -> None:
+        _, meta_path = self._entry(url)
+        if meta := self.get(url):
+            meta["last_used"] = time.time()
+            self._write_meta(meta_path, meta)
+
+    def link(self, url: str, path: str) -> bool:
+        """将缓存内容以硬链接的形式放到path(跨文件系统时复制)"""
+        body_path, _ = self._entry(url)
+        if self.get(url) is None:
+            return False
+        if os.path.lexists(path):
+            os.remove(path)
+        try:
+            os.link(body_path, path)
+        except OSError:
+            shutil.copy2(body_path, path)
+        self.touch(url)
+        return True
+
+    def read(self, url: str) -> bytes | None:
+        body_path, _ = self._entry(url)
+        if self.get(url) is None:
+            return None
+        try:
+            with open(body_path, "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        self.touch(url)
+        return content
+
+    def put_file(self, url: str, path: str, etag: str | None, last_modified: str | None) -> None:
+        """缓存已下载的文件, 没有ETag与Last-Modified的响应无法验证, 不缓存"""
+        if not etag and not last_modified:
+            return
+        body_path, meta_path = self._entry(url)
+        tmp_path = f"{body_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, body_path)
+        self._write_meta(meta_path, {"url": url, "etag": etag, "last_modified": last_modified,
+                                     "size": os.path.getsize(body_path), "last_used": time.time()})
+        self.evict()
+
+    def put_bytes(self, url: str, content: bytes, etag: str | None, last_modified: str | None, encoding: str | None = None) -> None:
+        if not etag and not last_modified:
+            return
+        body_path, meta_path = self._entry(url)
+        tmp_path = f"{body_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, body_path)
+        self._write_meta(meta_path, {"url": url, "etag": etag, "last_modified": last_modified, "encoding": encoding,
+                                     "size": len(content), "last_used": time.time()})
+        self.evict()
+
+    def remove(self, url: str) -> None:
+        for path in self._entry(url):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def evict(self) -> None:
+        """按最近使用时间淘汰条目, 直到总大小不超过max_size"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.path, name), encoding="utf-8") as f:
+                    meta = json.load(f)
+                entries.append((meta["last_used"], meta["size"], meta["url"]))
+                total += meta["size"]
+            except (OSError, ValueError, KeyError):
+                continue
+        if total <= self.max_size:
+            return
+        for _, size, url in sorted(entries):
+            logger.debug("淘汰HTTP缓存: %s", url)
+            self.remove(url)
+            total -= size
+            if total <= self.max_size:
+                break
+
+
+_http_cache: HTTPCache | None = None
+
+
+def get_http_cache() -> HTTPCache:
+    global _http_cache  # noqa: PLW0603
+    if _http_cache is None:
+        _http_cache = HTTPCache(os.path.join(paths.cache, "http"))
+    return _http_cache
@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import fcntl
+import functools
+import gzip
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import httpx
+
+from .downloader import dl2, wait_dl_tasks
+from .ghapi import get_gh_repo_last_releases
+from .logger import logger
+from .network import request, request_get
+from .paths import paths
+
+# Actions缓存中核心缓存目录的键前缀
+CORE_CACHE_PREFIX = "cores-"
+OPENCLASH_CORE_URL = "https://raw.githubusercontent.com/vernesong/OpenClash/core/master"
+
+
+def extract_tar_member(archive: str, member: str, dest: str) -> bool:
+    """从tar.gz中流式解压单个文件"""
+    with tarfile.open(archive, "r:gz") as tar:
+        try:
+            file = tar.extractfile(member)
+        except KeyError:
+            file = None
+        if file is None:
+            logger.error("%s中没有%s", archive, member)
+            return False
+        with file, open(dest, "wb") as f:
+            shutil.copyfileobj(file, f)
+    os.chmod(dest, 0o755)  # noqa: S103
+    return True
+
+
+def extract_gzip(archive: str, dest: str) -> None:
+    with gzip.open(archive, "rb") as f_in, open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.chmod(dest, 0o755)  # noqa: S103
+
+
+class CoreCache:
+    """按(项目, 版本, 架构)缓存解压后的核心文件
+
+    同一次运行中的各配置(包括进程池中的工作进程)共享同一份缓存, 条目通过文件锁保证只下载一次。
+    缓存目录可以在运行之间缓存, 版本没有变化的核心不会再次下载, 一次运行中没有用到的条目在结束时删除。
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def get_path(self, project: str, version: str, arch: str) -> str:
+        return os.path.join(self.root, project, version, arch)
+
+    def get(self, project: str, version: str, arch: str, fetch: Callable[[str], Any]) -> str:
+        """获取条目目录, 不存在时调用fetch(临时目录)下载并解压后移入缓存, fetch抛出异常时不会留下条目"""
+        path = self.get_path(project, version, arch)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isdir(path):
+                logger.debug("%s核心缓存命中: %s %s", project, version, arch)
+                # 记录使用时间, 清理时保留本次运行用到的条目
+                os.utime(path)
+                return path
+            tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+            try:
+                fetch(tmp_path)
+                os.rename(tmp_path, path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
+
+    def prune(self, since: float) -> None:
+        """删除since之后没有使用过的条目"""
+        if not os.path.isdir(self.root):
+            return
+        for project in os.listdir(self.root):
+            for version in os.listdir(os.path.join(self.root, project)):
+                version_path = os.path.join(self.root, project, version)
+                for name in os.listdir(version_path):
+                    path = os.path.join(version_path, name)
+                    if os.path.isdir(path) and os.path.getmtime(path) < since:
+                        logger.debug("删除不再使用的%s核心缓存: %s %s", project, version, name)
+                        shutil.rmtree(path, ignore_errors=True)
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(path + ".lock")
+                if not any(os.path.isdir(os.path.join(version_path, name)) for name in os.listdir(version_path)):
+                    shutil.rmtree(version_path, ignore_errors=True)
+
+
+_core_cache: CoreCache | None = None
+
+
+def get_core_cache() -> CoreCache:
+    global _core_cache  # noqa: PLW0603
+    if _core_cache is None:
+        _core_cache = CoreCache(os.path.join(paths.cache, "cores"))
+    return _core_cache
+
+
+def get_core_versions() -> dict[str, Any]:
+    """获取AdGuardHome的最新发布与OpenClash的core_version, 供所有配置共用"""
+    adg_release = get_gh_repo_last_releases("AdguardTeam/AdGuardHome")
+    clash_versions = request_get(f"{OPENCLASH_CORE_URL}/core_version")
+    return {"AdGuardHome": adg_release, "OpenClash": clash_versions}
+
+
+def get_remote_version(url: str) -> str | None:
+    """获取不带版本号的地址当前内容的版本(ETag或Last-Modified的摘要), 获取失败时返回None"""
+    try:
+        response = request("HEAD", url)
+    except httpx.HTTPError as e:
+        logger.warning("获取%s的版本失败 %s", url, f"{e.__class__.__name__}: {e!s}")
+        return None
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    if response.status_code != 200 or not validator:
+        logger.warning("无法获取%s的版本, 状态码: %s", url, response.status_code)
+        return None
+    return hashlib.sha256(validator.encode("utf-8")).hexdigest()[:16]
+
+
+def prune_cores(since: float) -> None:
+    """只保留since之后用到的核心缓存"""
+    get_core_cache().prune(since)
+
+
+def get_adguardhome(release: dict, arch: str) -> str | None:
+    """获取AdGuardHome核心所在的缓存目录"""
+    for asset in release["assets"]:
+        if asset["name"] == f"AdGuardHome_linux_{arch}.tar.gz":
+            break
+    else:
+        logger.error("未找到可用的AdGuardHome二进制文件")
+        return None
+
+    def fetch(path: str) -> None:
+        archive = os.path.join(path, "AdGuardHome.tar.gz")
+        wait_dl_tasks([dl2(asset["browser_download_url"], archive, cache=False, sha256=asset.get("digest"), size=asset.get("size"))])
+        if not extract_tar_member(archive, "./AdGuardHome/AdGuardHome", os.path.join(path, "AdGuardHome")):
+            msg = f"无法从{asset['name']}中解压AdGuardHome核心"
+            raise FileNotFoundError(msg)
+        os.remove(archive)
+
+    try:
+        return get_core_cache().get("AdGuardHome", release["tag_name"], arch, fetch)
+    except FileNotFoundError:
+        return None
+
+
+def fetch_core(url: str, member: str | None, name: str, path: str) -> None:
+    """下载核心并解压到path/name, member为None时为gzip压缩的单个文件"""
+    archive = os.path.join(path, f"{name}.download")
+    wait_dl_tasks([dl2(url, archive, cache=False)])
+    if member is None:
+        extract_gzip(archive, os.path.join(path, name))
+    elif not extract_tar_member(archive, member, os.path.join(path, name)):
+        msg = f"无法从{url}中解压{name}核心"
+        raise FileNotFoundError(msg)
+    os.remove(archive)
+
+
+def install_openclash(core_version: str | None, arch: str, dest: str) -> None:
+    """将OpenClash核心(clash_tun、clash_meta、clash)安装到dest
+
+    clash_tun的地址带有版本号, 以core_version中的版本为键缓存; meta与dev核心的地址不带版本号, 以服务器返回的ETag为键缓存,
+    无法获取版本时直接下载不使用缓存。core_version获取失败时只安装meta与dev核心。
+    """
+    cores: dict[str, tuple[str, str | None, str | None]] = {}
+    lines = core_version.splitlines() if core_version else []
+    if len(lines) > 1 and (tun_v := lines[1]):
+        cores["clash_tun"] = (f"{OPENCLASH_CORE_URL}/premium/clash-{arch}-{tun_v}.gz", None, tun_v)
+    for name, kind in (("clash_meta", "meta"), ("clash", "dev")):
+        url = f"{OPENCLASH_CORE_URL}/{kind}/clash-{arch}.tar.gz"
+        cores[name] = (url, "clash", get_remote_version(url))
+
+    def install(name: str) -> None:
+        url, member, version = cores[name]
+        try:
+            if version is None:
+                fetch_core(url, member, name, dest)
+                return
+            path = get_core_cache().get("OpenClash", f"{name}-{version}", arch, functools.partial(fetch_core, url, member, name))
+        except FileNotFoundError as e:
+            # 压缩包中没有核心时跳过该核心(已记录错误), 不影响其他核心
+            logger.error("%s, 跳过", e)
+            return
+        shutil.copy2(os.path.join(path, name), os.path.join(dest, name))
+
+    with ThreadPoolExecutor(len(cores)) as executor:
+        list(executor.map(install, cores))
@@ -0,0 +1,234 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import re
+from collections import deque
+from collections.abc import Iterable
+
+from .metadata import PackageInfo
+
+# 条件表达式中的符号与运算符(!、&&、||与括号)
+CONDITION_TOKEN = re.compile(r"\s*(\(|\)|!|&&|\|\||[A-Za-z0-9_.+-]+)")
+
+
+def evaluate_condition(condition: str, symbols: dict[str, str]) -> bool | None:
+    """根据.config中的符号计算条件表达式, 包含无法识别的语法(例如比较运算)时返回None"""
+    tokens: list[str] = []
+    pos = 0
+    while pos < len(condition):
+        if not (match := CONDITION_TOKEN.match(condition, pos)):
+            return None
+        tokens.append(match.group(1))
+        pos = match.end()
+    pos = 0
+
+    def parse_or() -> bool | None:
+        nonlocal pos
+        result = parse_and()
+        while result is not None and pos < len(tokens) and tokens[pos] == "||":
+            pos += 1
+            right = parse_and()
+            result = None if right is None else result or right
+        return result
+
+    def parse_and() -> bool | None:
+        nonlocal pos
+        result = parse_not()
+        while result is not None and pos < len(tokens) and tokens[pos] == "&&":
+            pos += 1
+            right = parse_not()
+            result = None if right is None else result and right
+        return result
+
+    def parse_not() -> bool | None:
+        nonlocal pos
+        if pos >= len(tokens):
+            return None
+        item = tokens[pos]
+        pos += 1
+        if item == "!":
+            result = parse_not()
+            return None if result is None else not result
+        if item == "(":
+            result = parse_or()
+            if pos >= len(tokens) or tokens[pos] != ")":
+                return None
+            pos += 1
+            return result
+        if item in (")", "&&", "||"):
+            return None
+        return symbols.get(item, "n") != "n"
+
+    result = parse_or()
+    return result if pos == len(tokens) else None
+
+
+class Dependency:
+    """Depends中的一项软件包依赖, 例如+libfoo、+USE_GLIBC:libpthread、kmod-bar"""
+
+    __slots__ = ("condition", "name", "select")
+
+    def __init__(self, name: str, condition: str | None, select: bool) -> None:
+        self.name = name
+        self.condition = condition
+        self.select = select
+
+    def __repr__(self) -> str:
+        return f"{'+' if self.select else ''}{f'{self.condition}:' if self.condition else ''}{self.name}"
+
+    def is_active(self, symbols: dict[str, str] | None, default: bool = True) -> bool:
+        """根据.config中的符号判断条件是否成立, symbols为None或条件无法判断时返回default"""
+        if self.condition is None:
+            return True
+        if symbols is None:
+            return default
+        result = evaluate_condition(self.condition, symbols)
+        return default if result is None else result
+
+
+def parse_depends(depends: str | None) -> tuple[list[Dependency], list[str]]:
+    """解析Depends字段, 返回软件包依赖与"@"开头的符号依赖"""
+    dependencies: list[Dependency] = []
+    symbols: list[str] = []
+    for item in (depends or "").split():
+        select = item.startswith("+")
+        item = item.removeprefix("+")  # noqa: PLW2901
+        if item.startswith("@"):
+            symbols.append(item[1:])
+            continue
+        condition, _, name = item.rpartition(":")
+        # 版本约束等无法作为软件包名的部分
+        if not name or name.startswith(("(", "$")):
+            continue
+        dependencies.append(Dependency(name, condition or None, select))
+    return dependencies, symbols
+
+
+class DependencyGraph:
+    """由.packageinfo的Depends与Provides字段构建的软件包依赖图
+
+    依赖可以是虚拟软件包(由Provides提供), 查询时解析为提供它的软件包。
+    作为库供各步骤查询(OpenWrt.get_dependency_graph), OpenWrt.check_package_dependencies用它检查依赖问题,
+    与原来一样不在准备阶段自动运行。
+    """
+
+    def __init__(self, packages: dict[str, PackageInfo]) -> None:
+        self.packages = packages
+        self.providers: dict[str, set[str]] = {}
+        self.dependencies: dict[str, list[Dependency]] = {}
+        self.symbols: dict[str, list[str]] = {}
+        for name, package in packages.items():
+            for provide in (package.provides or "").split():
+                self.providers.setdefault(provide.removeprefix("@"), set()).add(name)
+            self.dependencies[name], self.symbols[name] = parse_depends(package.depends)
+
+        self.dependents: dict[str, set[str]] = {}
+        for name, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                for provider in self.resolve(dependency.name):
+                    self.dependents.setdefault(provider, set()).add(name)
+
+    def resolve(self, name: str) -> set[str]:
+        """获取软件包名或虚拟软件包名对应的软件包, 不存在时返回空集合"""
+        if name in self.packages:
+            return {name}
+        return self.providers.get(name, set())
+
+    def get_dependencies(self, name: str, recursive: bool = False, symbols: dict[str, str] | None = None) -> set[str]:
+        """获取软件包依赖的软件包, 指定symbols(.config中的符号)时忽略条件不成立的依赖"""
+        result: set[str] = set()
+        queue = deque([name])
+        while queue:
+            for dependency in self.dependencies.get(queue.popleft(), ()):
+                if not dependency.is_active(symbols):
+                    continue
+                for provider in self.resolve(dependency.name) - result:
+                    result.add(provider)
+                    if recursive:
+                        queue.append(provider)
+        return result
+
+    def get_dependents(self, name: str, recursive: bool = False) -> set[str]:
+        """获取依赖该软件包的软件包"""
+        result: set[str] = set()
+        queue = deque([name])
+        while queue:
+            for dependent in self.dependents.get(queue.popleft(), set()) - result:
+                result.add(dependent)
+                if recursive:
+                    queue.append(dependent)
+        return result
+
+    def find_missing(self, names: Iterable[str] | None = None, symbols: dict[str, str] | None = None) -> dict[str, list[Dependency]]:
+        """检查names(默认为所有软件包)中依赖不存在的软件包, 返回软件包到缺失依赖的映射
+
+        指定symbols时只报告条件确定成立的依赖, 无法判断的条件不报告, 避免误报。
+        """
+        missing: dict[str, list[Dependency]] = {}
+        for name in self.packages if names is None else names:
+            for dependency in self.dependencies.get(name, ()):
+                if dependency.is_active(symbols, default=symbols is None) and not self.resolve(dependency.name):
+                    missing.setdefault(name, []).append(dependency)
+        return missing
+
+    def find_cycles(self, names: Iterable[str] | None = None) -> list[list[str]]:
+        """查找names(默认为所有软件包)之间的循环依赖(强连通分量, Tarjan算法的非递归实现)"""
+        nodes = set(self.packages if names is None else names)
+        edges = {name: sorted(provider for dependency in self.dependencies.get(name, ()) for provider in self.resolve(dependency.name)
+                              if provider in nodes) for name in nodes}
+        index: dict[str, int] = {}
+        lowlink: dict[str, int] = {}
+        stack: list[str] = []
+        on_stack: set[str] = set()
+        cycles: list[list[str]] = []
+        for root in sorted(nodes):
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, i = work.pop()
+                if i == 0:
+                    index[node] = lowlink[node] = len(index)
+                    stack.append(node)
+                    on_stack.add(node)
+                if i < len(edges[node]):
+                    work.append((node, i + 1))
+                    child = edges[node][i]
+                    if child not in index:
+                        work.append((child, 0))
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                    continue
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in edges[node]:
+                        cycles.append(sorted(component))
+        return cycles
+
+    def explain(self, name: str, roots: Iterable[str]) -> list[str] | None:
+        """解释软件包为什么被引入: 返回从roots中某个软件包到name的最短依赖链, 没有时返回None"""
+        parents: dict[str, str | None] = {}
+        queue: deque[str] = deque()
+        for root in roots:
+            if root in self.packages and root not in parents:
+                parents[root] = None
+                queue.append(root)
+        while queue:
+            node = queue.popleft()
+            if node == name:
+                chain = [node]
+                while (parent := parents[chain[-1]]) is not None:
+                    chain.append(parent)
+                return chain[::-1]
+            for dependency in self.get_dependencies(node) - parents.keys():
+                parents[dependency] = node
+                queue.append(dependency)
+        return None
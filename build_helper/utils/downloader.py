@@ -1,13 +1,45 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
 import os
+import re
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections.abc import AsyncIterator
+from concurrent.futures import Future
+from concurrent.futures import wait as wait_futures
+from typing import BinaryIO, Literal
 
 import httpx
 
+from .cache import HTTPCache, get_http_cache
 from .logger import logger
+from .tasks import get_task_group
+
+# 全局与单个主机的最大并发连接数
+MAX_CONNECTIONS = 16
+MAX_CONNECTIONS_PER_HOST = 6
+# 分片下载时每个分片在内存中缓存的最大字节数
+CHUNK_BUFFER_SIZE = 1024 * 1024
+# 断点续传日志文件的后缀
+JOURNAL_SUFFIX = ".dljournal"
+# 首个请求只获取开头的PROBE_SIZE字节, 不超过此大小的文件一次请求即可完成
+PROBE_SIZE = 1024 * 1024
+# 自动选择分片数时每个分片的最小大小与最大分片数
+MIN_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNKS = 8
+# 自动选择分片数时期望每个分片的下载耗时(秒)
+TARGET_CHUNK_SECONDS = 2
+# 小于此大小的传输主要受延迟影响, 不计入主机速度统计
+MIN_RATE_SAMPLE = 256 * 1024
+# 分片下载连续这么多次没有明显快于单连接时, 才认为该主机限制了速度并不再分片
+SLOW_RANGES_SAMPLES = 3
+# 表示服务器暂时无法处理的状态码, 遇到时重试而不是放弃分片下载
+TRANSIENT_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
 
 
 class DownloadError(Exception):
@@ -24,17 +56,257 @@ class DownloadError(Exception):
     def __repr__(self) -> str:
         return self.__str__()
 
+
+class RangeUnsupportedError(DownloadError):
+    """服务器没有按请求返回分片(不支持分片或文件已变更)"""
+
+
+class IntegrityError(DownloadError):
+    """下载的文件与预期的大小或sha256不符"""
+
+
+class DLEngine:
+    """在后台线程中运行的asyncio下载引擎, 所有下载任务共享同一个事件循环与连接池"""
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS, max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST) -> None:
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        # fork出的子进程不会继承事件循环线程, 需要据此重新创建引擎
+        self.pid = os.getpid()
+
+        self.client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+        # 各主机单连接的平均下载速度(字节/秒)与不支持(或限制)分片下载的主机
+        self.host_rates: dict[str, float] = {}
+        self.no_range_hosts: set[str] = set()
+        # 各主机连续出现分片下载没有提速的次数
+        self.slow_ranges: dict[str, int] = {}
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="DLEngine", daemon=True)
+        self.thread.start()
+
+    def submit(self, task: "DLTask") -> Future:
+        return asyncio.run_coroutine_threadsafe(self._run(task), self.loop)
+
+    async def _run(self, task: "DLTask") -> None:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                http2=True,
+                follow_redirects=True,
+                timeout=httpx.Timeout(30, connect=10),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        await task.download(self.client, self)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """占用一个全局连接槽位与一个目标主机的连接槽位"""
+        host = httpx.URL(url).host
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_connections_per_host)
+        if self._semaphore is None:
+            msg = "下载引擎尚未初始化"
+            raise RuntimeError(msg)
+        async with self._semaphore, self._host_semaphores[host]:
+            yield
+
+    def record_rate(self, host: str, size: int, seconds: float) -> None:
+        """记录一次单连接传输的速度"""
+        if size < MIN_RATE_SAMPLE or seconds <= 0:
+            return
+        rate = size / seconds
+        self.host_rates[host] = rate if host not in self.host_rates else (self.host_rates[host] + rate) / 2
+
+    def record_ranges_rate(self, host: str, num_ranges: int, size: int, seconds: float, single_rate: float | None) -> None:
+        """记录一次多分片下载的总速度, 连续多次没有明显超过单连接速度时不再对该主机分片下载"""
+        if num_ranges < 2 or not single_rate or size < MIN_RATE_SAMPLE * num_ranges or seconds <= 0:
+            return
+        rate = size / seconds
+        if rate >= single_rate * 1.2:
+            self.slow_ranges.pop(host, None)
+            return
+        self.slow_ranges[host] = self.slow_ranges.get(host, 0) + 1
+        if self.slow_ranges[host] >= SLOW_RANGES_SAMPLES:
+            self.disable_ranges(host, f"{num_ranges} ranges reached {rate / 1024 ** 2:.2f} MB/s, "
+                                      f"single connection {single_rate / 1024 ** 2:.2f} MB/s ({self.slow_ranges[host]} times in a row)")
+
+    def disable_ranges(self, host: str, reason: str) -> None:
+        if host not in self.no_range_hosts:
+            logger.info(f"Disable ranged downloads for {host}: {reason}")
+            self.no_range_hosts.add(host)
+
+
+class DLJournal:
+    """记录分片下载进度的旁路日志, 每个分片保存为[起始位置, 结束位置, 已写入位置]"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path + JOURNAL_SUFFIX
+        self.url: str | None = None
+        self.validator: str | None = None
+        self.content_length = 0
+        self.ranges: list[list[int]] = []
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                journal = json.load(f)
+            self.url = journal["url"]
+            self.validator = journal["validator"]
+            self.content_length = journal["content_length"]
+            self.ranges = journal["ranges"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def matches(self, url: str, validator: str | None, content_length: int, file_path: str) -> bool:
+        """日志是否属于同一个文件(ETag/Last-Modified与大小都未变化)"""
+        return (self.url == url and
+                self.validator == validator and
+                self.content_length == content_length and
+                os.path.isfile(file_path) and os.path.getsize(file_path) == content_length)
+
+    def reset(self, url: str, validator: str | None, content_length: int, ranges: list[tuple[int, int]]) -> None:
+        self.url = url
+        self.validator = validator
+        self.content_length = content_length
+        self.ranges = [[start, end, start] for start, end in ranges]
+
+    def remaining(self) -> int:
+        return sum(end + 1 - pos for _start, end, pos in self.ranges)
+
+    def save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url,
+                       "validator": self.validator,
+                       "content_length": self.content_length,
+                       "ranges": self.ranges}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+
+class DLVerifier:
+    """在写入的同时按文件顺序计算sha256
+
+    按顺序到达的数据在写入时直接计算, 其他分片先行写入的数据会在计算位置推进到它们时从文件(页缓存)中读回。
+    """
+
+    def __init__(self, sha256: str | None, size: int | None) -> None:
+        self.sha256 = sha256.removeprefix("sha256:").lower() if sha256 else None
+        self.size = size
+        self.reset()
+
+    def reset(self) -> None:
+        self.hash = hashlib.sha256()
+        self.frontier = 0
+        # 已写入但还未计算的区间: 起始位置->结束位置, 以及结束位置->起始位置
+        self._extents: dict[int, int] = {}
+        self._ends: dict[int, int] = {}
+
+    def mark(self, start: int, end: int) -> None:
+        """记录[start, end)已写入文件但未计算"""
+        if start >= end or end <= self.frontier:
+            return
+        start = self._ends.pop(start, start)
+        self._extents[start] = end
+        self._ends[end] = start
+
+    def update(self, fd: int | None, pos: int, data: bytes) -> None:
+        if pos == self.frontier:
+            self.hash.update(data)
+            self.frontier += len(data)
+            if fd is not None:
+                self.advance(fd)
+        else:
+            self.mark(pos, pos + len(data))
+
+    def advance(self, fd: int) -> None:
+        while (end := self._extents.pop(self.frontier, None)) is not None:
+            del self._ends[end]
+            while self.frontier < end:
+                data = os.pread(fd, min(CHUNK_BUFFER_SIZE, end - self.frontier), self.frontier)
+                if not data:
+                    msg = f"文件在{self.frontier}处意外结束"
+                    raise OSError(msg)
+                self.hash.update(data)
+                self.frontier += len(data)
+
+    def missing(self) -> list[tuple[int, int]] | None:
+        """文件比预期短时返回还没有写入的区间[起始位置, 结束位置], 其他情况(无法定位出错的区间)返回None"""
+        if self.size is None or self.frontier >= self.size:
+            return None
+        holes = []
+        pos = self.frontier
+        for start in sorted(self._extents):
+            end = self._extents[start]
+            if end > self.size:
+                return None
+            if start > pos:
+                holes.append((pos, start - 1))
+            pos = max(pos, end)
+        if pos < self.size:
+            holes.append((pos, self.size - 1))
+        return holes
+
+    def check(self) -> str | None:
+        """返回校验失败的原因, 校验通过时返回None"""
+        if self.size is not None and self.frontier != self.size:
+            return f"size {self.frontier} != expected {self.size}"
+        if self.sha256 and (digest := self.hash.hexdigest()) != self.sha256:
+            return f"sha256 {digest} != expected {self.sha256}"
+        return None
+
+
+_engine: DLEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> DLEngine:
+    global _engine  # noqa: PLW0603
+    with _engine_lock:
+        if _engine is None or _engine.pid != os.getpid():
+            _engine = DLEngine()
+        return _engine
+
+
 class DLTask:
-    def __init__(self, url: str, path: str, retry: int, num_chunks: int, headers: dict | None) -> None:
+    def __init__(self, url: str, path: str, retry: int, num_chunks: int | None, headers: dict | None,
+                 chunk_buffer_size: int = CHUNK_BUFFER_SIZE, cache: HTTPCache | None = None,
+                 sha256: str | None = None, size: int | None = None) -> None:
         self.url = url
+        self.host = httpx.URL(url).host
         self.path = os.path.abspath(path)
         self.retry = retry
+        # None表示根据文件大小与主机速度自动选择分片数
         self.num_chunks = num_chunks
+        self.chunk_buffer_size = chunk_buffer_size
         self.headers = headers or {}
+        self.cache = cache
+        self.etag: str | None = None
+        self.last_modified: str | None = None
         self.error: Exception | None = None
         self.completed = False
+        self.journal = DLJournal(self.path)
+        # 提供了预期的sha256或大小时边下载边校验
+        self.verifier = DLVerifier(sha256, size) if sha256 or size is not None else None
+        # 实际使用的下载方式与平均速度(MB/s)
+        self.strategy: str | None = None
+        self.size = 0
+        self.speed: float | None = None
 
-        if os.path.exists(self.path):
+        if self.journal.exists():
+            logger.info(f"Found download journal for {self.path}, will try to resume.")
+        elif os.path.exists(self.path):
             os.remove(self.path)
             logger.warning(f"File {self.path} already exists, removed.")
 
@@ -42,102 +314,335 @@ class DLTask:
             os.makedirs(os.path.dirname(self.path))
             logger.info(f"Directory {os.path.dirname(self.path)} created.")
 
-        self.thread = threading.Thread(target=self._download)
-        self.thread.start()
+        self.future = get_engine().submit(self)
 
-    def _download(self) -> None:
+    async def download(self, client: httpx.AsyncClient, engine: DLEngine) -> None:
+        start_time = time.monotonic()
         try:
-            with httpx.Client(headers=self.headers, follow_redirects=True) as client:
-                try:
-                    # 检查服务器是否支持分片下载
-                    resp = client.head(self.url)
-                    resp.raise_for_status()
-                    accept_ranges = resp.headers.get("Accept-Ranges") == "bytes"
-                    content_length = int(resp.headers.get("Content-Length", 0))
-                except (httpx.HTTPError, httpx.RequestError):
-                    accept_ranges = False
-                    content_length = 0
-
-                if accept_ranges and content_length > 0 and self.num_chunks > 1:
-                    try:
-                        self._download_chunks(client, content_length)
-                    except Exception:
-                        self._download_whole(client)
+            # 校验失败时立即重新下载一次, 能定位到缺失的区间时只重新下载这些区间
+            missing: list[tuple[int, int]] | None = None
+            for attempt in range(2):
+                if missing:
+                    await self._download_missing(client, engine, missing)
+                    if self.cache is not None:
+                        self.cache.put_file(self.url, self.path, self.etag, self.last_modified)
+                elif (attempt == 0 and self.cache is not None and (meta := self.cache.get(self.url)) and
+                      (result := await self._revalidate(client, engine, meta))):
+                    if result == "updated":
+                        # 内容已变化, 新内容需要写回缓存, 否则之后会一直使用旧的ETag
+                        self.strategy = "whole"
+                        self.cache.put_file(self.url, self.path, self.etag, self.last_modified)
+                    else:
+                        self.strategy = "cache"
                 else:
-                    self._download_whole(client)
+                    await self._download(client, engine)
+                    if self.cache is not None:
+                        self.cache.put_file(self.url, self.path, self.etag, self.last_modified)
+                if self.verifier is None or (problem := self.verifier.check()) is None:
+                    break
+                if self.cache is not None:
+                    self.cache.remove(self.url)
+                if attempt == 1:
+                    self.journal.remove()
+                    self._raise_download_error(IntegrityError(problem, self))
+                if missing := self._pinned_ranges(engine):
+                    logger.warning(f"Integrity check failed for {self.url}: {problem}, "
+                                   f"downloading {sum(end + 1 - start for start, end in missing)} missing bytes again.")
+                else:
+                    self.journal.remove()
+                    logger.warning(f"Integrity check failed for {self.url}: {problem}, downloading again.")
+            self.speed = self.size / max(time.monotonic() - start_time, 1e-6) / 1024 ** 2
+            logger.info(f"Downloaded {self.url} ({self.strategy}, {self.size / 1024 ** 2:.2f} MB, {self.speed:.2f} MB/s)")
         except Exception as e:
             self.error = e
         finally:
             self.completed = True
 
-    def _download_chunks(self, client: httpx.Client, content_length: int) -> None:
-        # 计算块范围
-        num_chunks = min(self.num_chunks, content_length)
-        chunk_size = content_length // num_chunks
-        ranges = [
-            (
-                i * chunk_size,
-                (i + 1) * chunk_size - 1 if i < num_chunks - 1 else content_length - 1,
-            )
-            for i in range(num_chunks)
-        ]
-
-        # 预先分配文件
-        with open(self.path, "wb") as f:
-            f.truncate(content_length)
-
-        # 并行下载块
-        with ThreadPoolExecutor(max_workers=num_chunks) as executor:
-            futures = [executor.submit(self._download_chunk, client, start, end) for start, end in ranges]
-
-            for future in as_completed(futures):
-                try:
-                    data, pos = future.result()
-                    self._write_chunk(pos, data)
-                except Exception:
-                    executor.shutdown(wait=False, cancel_futures=True)
-                    raise
+    async def _download(self, client: httpx.AsyncClient, engine: DLEngine) -> None:
+        if self.host in engine.no_range_hosts or self.num_chunks == 0:
+            self.journal.remove()
+            await self._download_whole(client, engine)
+            return
 
-    def _download_chunk(self, client: httpx.Client, start: int, end: int) -> tuple[bytes, int]:
+        # 用一个只请求开头部分的GET代替HEAD, 小文件在这个请求中就能下载完成
         headers = self.headers.copy()
-        headers["Range"] = f"bytes={start}-{end}"
+        headers["Range"] = f"bytes=0-{PROBE_SIZE - 1}"
+        total: int | None = None
+        validator = probe = None
+        for attempt in range(self.retry + 1):
+            try:
+                async with engine.slot(self.url), client.stream("GET", self.url, headers=headers) as response:
+                    response.raise_for_status()
+                    self.etag, self.last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                    if response.status_code == 200:
+                        # 服务器忽略了Range并返回了完整内容, 直接使用这个响应下载整个文件
+                        engine.disable_ranges(self.host, "Range ignored")
+                        self.journal.remove()
+                        await self._write_whole(response, engine)
+                        return
+                    content_range = re.match(r"bytes 0-\d+/(?P<total>\d+)$", response.headers.get("Content-Range", ""))
+                    if response.status_code != 206 or not content_range:
+                        # 无法确定文件大小, 只对这个文件放弃分片下载
+                        logger.warning(f"Unexpected probe response for {self.url} (status {response.status_code}), downloading the whole file.")
+                        break
+                    total = int(content_range.group("total"))
+                    if self.verifier and self.verifier.size is not None and total != self.verifier.size:
+                        msg = f"size {total} != expected {self.verifier.size}"
+                        self._raise_download_error(IntegrityError(msg, self))
+                    validator = self.etag or self.last_modified
+                    if not (self.journal.load() and self.journal.matches(self.url, validator, total, self.path)):
+                        probe = (await response.aread())[:PROBE_SIZE]
+                break
+            except httpx.HTTPError as e:
+                total = None
+                # 连接错误与限流等临时错误重试探测请求, 不影响该主机之后的下载方式
+                if attempt < self.retry and (not isinstance(e, httpx.HTTPStatusError) or e.response.status_code in TRANSIENT_STATUS_CODES):
+                    await asyncio.sleep(1)
+                    continue
+                logger.warning(f"Probe request for {self.url} failed, downloading the whole file.")
+                break
+        if total is None:
+            self.journal.remove()
+            await self._download_whole(client, engine)
+            return
+
+        try:
+            await self._download_chunks(client, engine, total, validator, probe)
+        except RangeUnsupportedError:
+            logger.warning(f"Server did not honor ranges for {self.url}, downloading the whole file.")
+            self.journal.remove()
+            await self._download_whole(client, engine)
+
+    def _pinned_ranges(self, engine: DLEngine) -> list[tuple[int, int]] | None:
+        """校验失败时可以单独重新下载的区间
+
+        只有文件比预期短时才能确定出错的区间(没有写入的部分), sha256不符时无法定位, 需要重新下载整个文件。
+        补齐缺失部分依赖分片下载与强验证器(If-Range), 保证补上的内容与已写入的部分属于同一版本。
+        """
+        if self.verifier is None or self.strategy == "cache" or self.num_chunks == 0 or self.host in engine.no_range_hosts:
+            return None
+        validator = self.etag or self.last_modified
+        if not validator or validator.startswith("W/"):
+            return None
+        return self.verifier.missing()
+
+    async def _download_missing(self, client: httpx.AsyncClient, engine: DLEngine, missing: list[tuple[int, int]]) -> None:
+        """只重新下载缺失的区间, 其余部分作为已完成的分片写入日志"""
+        if self.verifier is None or self.verifier.size is None:
+            return
+        size = self.verifier.size
+        ranges: list[tuple[int, int]] = []
+        pos = 0
+        for start, end in missing:
+            if start > pos:
+                ranges.append((pos, start - 1))
+            ranges.append((start, end))
+            pos = end + 1
+        if pos < size:
+            ranges.append((pos, size - 1))
+        self.journal.reset(self.url, self.etag or self.last_modified, size, ranges)
+        for chunk in self.journal.ranges:
+            if (chunk[0], chunk[1]) not in missing:
+                chunk[2] = chunk[1] + 1
+        try:
+            await self._download_chunks(client, engine, size, self.journal.validator, None)
+        except RangeUnsupportedError:
+            logger.warning(f"Server did not honor ranges for {self.url}, downloading the whole file.")
+            self.journal.remove()
+            await self._download_whole(client, engine)
 
+    def _choose_chunks(self, engine: DLEngine, size: int) -> int:
+        """根据剩余大小与该主机此前的单连接速度选择分片数"""
+        if self.num_chunks is not None:
+            return max(min(self.num_chunks, size), 1)
+        num_chunks = min(size // MIN_CHUNK_SIZE, MAX_CHUNKS, engine.max_connections_per_host)
+        if rate := engine.host_rates.get(self.host):
+            # 单连接就能很快下载完成时不再分片
+            num_chunks = min(num_chunks, math.ceil(size / (rate * TARGET_CHUNK_SECONDS)))
+        return max(num_chunks, 1)
+
+    async def _revalidate(self, client: httpx.AsyncClient, engine: DLEngine, meta: dict) -> Literal["hit", "updated"] | None:
+        """使用条件请求验证缓存, 未变化时直接使用缓存(hit), 已变化时顺便下载新内容(updated), 其他情况返回None"""
+        if self.cache is None:
+            return None
+        headers = {**self.headers, **self.cache.conditional_headers(meta)}
+        try:
+            async with engine.slot(self.url), client.stream("GET", self.url, headers=headers) as response:
+                if response.status_code == 304:
+                    self.journal.remove()
+                    self.cache.link(self.url, self.path)
+                    self.size = meta["size"]
+                    if self.verifier is not None:
+                        self._verify_file()
+                    logger.info(f"Cache hit: {self.url} -> {self.path}")
+                    return "hit"
+                if response.status_code != 200:
+                    return None
+                self.journal.remove()
+                self.etag, self.last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                await self._write_whole(response, engine)
+                logger.info(f"Cache updated: {self.url}")
+                return "updated"
+        except httpx.HTTPError:
+            return None
+
+    async def _download_chunks(self, client: httpx.AsyncClient, engine: DLEngine, content_length: int, validator: str | None,
+                               probe: bytes | None) -> None:
+        self._unlink_shared()
+        if self.verifier is not None:
+            self.verifier.reset()
+        if probe is None:
+            logger.info(f"Resuming {self.path}, {self.journal.remaining()}/{content_length} bytes remaining.")
+            self.strategy = "resume"
+        else:
+            # 开头部分已经由探测请求下载, 剩余部分按选择的分片数划分
+            offset = min(len(probe), content_length)
+            num_chunks = self._choose_chunks(engine, content_length - offset)
+            chunk_size = (content_length - offset) // num_chunks
+            ranges = [(0, offset - 1)] if offset else []
+            ranges += [
+                (
+                    offset + i * chunk_size,
+                    offset + (i + 1) * chunk_size - 1 if i < num_chunks - 1 else content_length - 1,
+                )
+                for i in range(num_chunks) if content_length > offset
+            ]
+            self.journal.reset(self.url, validator, content_length, ranges)
+            if offset:
+                self.journal.ranges[0][2] = offset
+            self.strategy = "single" if content_length <= offset else f"chunks:{num_chunks}"
+
+        # 预先分配文件, 所有块共用同一个文件描述符按偏移写入
+        self.size = content_length
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, content_length)
+            if probe:
+                os.pwrite(fd, probe[:content_length], 0)
+                self._written(fd, 0, probe[:content_length])
+            elif self.verifier is not None:
+                # 续传时先计算之前已写入的部分
+                for start, _end, pos in self.journal.ranges:
+                    self.verifier.mark(start, pos)
+                self.verifier.advance(fd)
+            pending = [chunk for chunk in self.journal.ranges if chunk[2] <= chunk[1]]
+            if not pending:
+                return
+            self.journal.save()
+            # 并行下载未完成的块, 任意一块失败时取消其余的块
+            start_time = time.monotonic()
+            prior_rate = engine.host_rates.get(self.host)
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    for chunk in pending:
+                        tg.create_task(self._download_chunk(client, engine, fd, chunk))
+            except ExceptionGroup as e:
+                raise e.exceptions[0] from e
+            # 多个分片的总速度没有明显超过单连接速度时, 该主机可能限制了速度
+            engine.record_ranges_rate(self.host, len(pending), sum(end + 1 - start for start, end, _ in pending),
+                                      time.monotonic() - start_time, prior_rate)
+        finally:
+            os.close(fd)
+            if not self.journal.remaining():
+                self.journal.remove()
+
+    async def _download_chunk(self, client: httpx.AsyncClient, engine: DLEngine, fd: int, chunk: list[int]) -> None:
+        _start, end, pos = chunk
         for attempt in range(self.retry + 1):
+            # 重试时从已写入的位置继续
+            headers = self.headers.copy()
+            headers["Range"] = f"bytes={pos}-{end}"
+            if self.journal.validator and not self.journal.validator.startswith("W/"):
+                # 文件在续传期间发生变化时服务器会返回完整文件而不是分片
+                headers["If-Range"] = self.journal.validator
+            start_pos, start_time = pos, time.monotonic()
             try:
-                resp = client.get(self.url, headers=headers)
-                if resp.status_code == 206:
-                    return resp.content, start
-                msg = f"Unexpected status code {resp.status_code}"
-                self._raise_download_error(httpx.HTTPStatusError(
-                    msg,
-                    request=resp.request,
-                    response=resp,
-                ))
+                async with engine.slot(self.url), client.stream("GET", self.url, headers=headers) as resp:
+                    if resp.status_code == 200:
+                        # 带If-Range时200表示文件已变化, 只有不带时才说明服务器忽略了Range
+                        if "If-Range" not in headers:
+                            engine.disable_ranges(self.host, "Range ignored")
+                        msg = "Server returned the whole file instead of a range"
+                        self._raise_download_error(RangeUnsupportedError(msg, self))
+                    if resp.status_code != 206 or not resp.headers.get("Content-Range", "").startswith(f"bytes {pos}-"):
+                        msg = f"Unexpected status code {resp.status_code}"
+                        self._raise_download_error(httpx.HTTPStatusError(
+                            msg,
+                            request=resp.request,
+                            response=resp,
+                        ))
+                    # 每次最多缓存chunk_buffer_size字节, 内存占用与文件大小无关
+                    async for data in resp.aiter_bytes(self.chunk_buffer_size):
+                        size = min(len(data), end + 1 - pos)
+                        os.pwrite(fd, data[:size], pos)
+                        self._written(fd, pos, data[:size])
+                        pos += size
+                        chunk[2] = pos
+                        self.journal.save()
+                engine.record_rate(self.host, pos - start_pos, time.monotonic() - start_time)
+                if pos == end + 1:
+                    return
+                msg = f"Chunk truncated at {pos} (expected end {end})"
+                self._raise_download_error(DownloadError(msg, self))
+            except RangeUnsupportedError:
+                raise
             except Exception:
                 if attempt == self.retry:
                     raise
-                time.sleep(1)
+                await asyncio.sleep(1)
         msg = "Chunk download failed after retries"
         raise DownloadError(msg, self)
 
-    def _write_chunk(self, pos: int, data: bytes) -> None:
-        with open(self.path, "r+b") as f:
-            f.seek(pos)
-            f.write(data)
+    def _written(self, fd: int | None, pos: int, data: bytes) -> None:
+        if self.verifier is not None:
+            self.verifier.update(fd, pos, data)
+
+    def _verify_file(self) -> None:
+        """校验没有经过下载流程的文件(如缓存命中)"""
+        if self.verifier is None:
+            return
+        self.verifier.reset()
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self.verifier.mark(0, os.fstat(fd).st_size)
+            self.verifier.advance(fd)
+        finally:
+            os.close(fd)
+
+    def _unlink_shared(self) -> None:
+        """文件可能是指向缓存的硬链接, 写入前先断开, 避免改动缓存内容"""
+        if os.path.isfile(self.path) and os.stat(self.path).st_nlink > 1:
+            os.remove(self.path)
+
+    def _open_whole(self) -> BinaryIO:
+        if os.path.lexists(self.path):
+            os.remove(self.path)
+        return open(self.path, "wb")
+
+    async def _write_whole(self, response: httpx.Response, engine: DLEngine) -> None:
+        self.strategy = "whole"
+        start_time = time.monotonic()
+        if self.verifier is not None:
+            self.verifier.reset()
+        with self._open_whole() as f:
+            async for chunk in response.aiter_bytes():
+                self._written(None, f.tell(), chunk)
+                f.write(chunk)
+            self.size = f.tell()
+        engine.record_rate(self.host, self.size, time.monotonic() - start_time)
 
-    def _download_whole(self, client: httpx.Client) -> None:
+    async def _download_whole(self, client: httpx.AsyncClient, engine: DLEngine) -> None:
         for attempt in range(self.retry + 1):
             try:
-                with client.stream("GET", self.url, headers=self.headers) as response:
+                async with engine.slot(self.url), client.stream("GET", self.url, headers=self.headers) as response:
                     response.raise_for_status()
-                    with open(self.path, "wb") as f:
-                        for chunk in response.iter_bytes():
-                            f.write(chunk)
+                    self.etag, self.last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                    await self._write_whole(response, engine)
                     return
             except Exception:
                 if attempt == self.retry:
                     raise
-                time.sleep(1)
+                await asyncio.sleep(1)
 
     def _raise_download_error(self, e: Exception) -> None:
         raise e
@@ -146,15 +651,31 @@ def dl2(
     url: str,
     path: str,
     retry: int = 6,
-    num_chunks: int = 4,
+    num_chunks: int | None = None,
     headers: dict | None = None,
+    chunk_buffer_size: int = CHUNK_BUFFER_SIZE,
+    cache: bool = True,
+    sha256: str | None = None,
+    size: int | None = None,
 ) -> DLTask:
-    return DLTask(url, path, retry, num_chunks, headers)
+    return DLTask(url, path, retry, num_chunks, headers, chunk_buffer_size, get_http_cache() if cache else None, sha256, size)
 
 
 def wait_dl_tasks(dl_tasks: list[DLTask]) -> None:
-    for task in dl_tasks:
-        task.thread.join()
+    """等待下载完成, 所在任务组被取消时取消所有未完成的下载(已下载的部分保留在日志中, 之后可以继续)"""
+    group = get_task_group()
+    futures = [task.future for task in dl_tasks]
+
+    def cancel() -> None:
+        for future in futures:
+            future.cancel()
+
+    group.add_callback(cancel)
+    try:
+        wait_futures(futures)
+    finally:
+        group.remove_callback(cancel)
+    group.check()
 
     for task in dl_tasks:
         if task.error is not None:
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import hashlib
+import os
+import shutil
+import threading
+
+from .logger import logger
+from .openwrt import OpenWrt
+from .paths import paths
+from .tasks import run_command
+
+# Actions缓存中feeds缓存目录的键前缀
+FEEDS_CACHE_PREFIX = "feeds-"
+
+
+def copy_tree(src: str, dst: str) -> None:
+    """复制目录, 文件系统支持时使用reflink(写时复制), 否则普通复制"""
+    if os.path.lexists(dst):
+        shutil.rmtree(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    run_command(["cp", "-a", "--reflink=auto", src, dst], check=True)
+
+
+class FeedsCache:
+    """按feeds.conf内容缓存scripts/feeds update -a的结果
+
+    feeds.conf中包含各feed的地址与分支或提交, 内容相同的配置共享同一份feeds,
+    每次运行中每份feeds只更新一次, 其余配置直接复制。
+    缓存目录可以在运行之间缓存, 恢复后的feeds只需增量更新。
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.updated: set[str] = set()
+        self.locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(openwrt: OpenWrt) -> str:
+        for name in ("feeds.conf", "feeds.conf.default"):
+            path = os.path.join(openwrt.path, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    return hashlib.sha256(f.read()).hexdigest()[:16]
+        msg = f"{openwrt.path}中没有feeds.conf或feeds.conf.default"
+        raise FileNotFoundError(msg)
+
+    def get_lock(self, key: str) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def update(self, openwrt: OpenWrt) -> None:
+        """将feeds更新到openwrt中, 同一份feeds在本次运行中已经更新过时直接复制"""
+        key = self.get_key(openwrt)
+        cache_path = os.path.join(self.root, key)
+        feeds_path = os.path.join(openwrt.path, "feeds")
+        with self.get_lock(key):
+            if os.path.isdir(cache_path):
+                logger.debug("从缓存%s复制feeds到%s", cache_path, feeds_path)
+                copy_tree(cache_path, feeds_path)
+            if key in self.updated:
+                return
+            logger.debug("更新feeds(%s)", key)
+            openwrt.feed_update()
+            # 先复制到临时目录, 避免中断时留下不完整的缓存
+            tmp_path = cache_path + ".tmp"
+            copy_tree(feeds_path, tmp_path)
+            shutil.rmtree(cache_path, ignore_errors=True)
+            os.rename(tmp_path, cache_path)
+            self.updated.add(key)
+
+    def prune(self) -> None:
+        """删除本次运行中没有用到的缓存"""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name not in self.updated:
+                logger.debug("删除不再使用的feeds缓存%s", name)
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+
+_feeds_cache: FeedsCache | None = None
+
+
+def get_feeds_cache() -> FeedsCache:
+    global _feeds_cache  # noqa: PLW0603
+    if _feeds_cache is None:
+        _feeds_cache = FeedsCache(os.path.join(paths.cache, "feeds"))
+    return _feeds_cache
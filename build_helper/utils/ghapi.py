@@ -0,0 +1,207 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any
+
+import httpx
+
+from .cache import HTTPCache
+from .logger import logger
+from .network import request
+from .paths import paths
+
+API_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+}
+# 剩余请求数低于该值时开始把剩余额度平摊到重置前的时间内
+RATE_LIMIT_RESERVE = 100
+# 额度耗尽时最多等待的时间(秒)
+RATE_LIMIT_MAX_WAIT = 3600
+
+
+class RateLimit:
+    """根据X-RateLimit-*响应头记录各资源的剩余额度, 在额度耗尽前放慢请求"""
+
+    def __init__(self) -> None:
+        self.remaining: dict[str, int] = {}
+        self.reset: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def update(self, response: httpx.Response) -> None:
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers or "X-RateLimit-Reset" not in headers:
+            return
+        resource = headers.get("X-RateLimit-Resource", "core")
+        try:
+            remaining, reset = int(headers["X-RateLimit-Remaining"]), float(headers["X-RateLimit-Reset"])
+        except ValueError:
+            return
+        with self.lock:
+            self.remaining[resource] = remaining
+            self.reset[resource] = reset
+        if remaining < RATE_LIMIT_RESERVE:
+            logger.warning("GitHub API额度(%s)剩余%s次, 将在%s秒后重置", resource, remaining, int(reset - time.time()))
+
+    def delay(self, resource: str = "core") -> float:
+        """下一次请求前需要等待的时间"""
+        with self.lock:
+            if resource not in self.remaining:
+                return 0
+            remaining, reset = self.remaining[resource], self.reset[resource]
+        window = reset - time.time()
+        if window <= 0 or remaining >= RATE_LIMIT_RESERVE:
+            return 0
+        if remaining <= 0:
+            return min(window + 1, RATE_LIMIT_MAX_WAIT)
+        return min(window / remaining, RATE_LIMIT_MAX_WAIT)
+
+    def wait(self, resource: str = "core") -> None:
+        if (delay := self.delay(resource)) > 0:
+            logger.debug("GitHub API额度不足, 等待%.1f秒", delay)
+            time.sleep(delay)
+
+    def consume(self, resource: str = "core") -> None:
+        # 并发请求时先扣除额度, 避免多个线程同时用掉最后的额度
+        with self.lock:
+            if resource in self.remaining:
+                self.remaining[resource] -= 1
+
+
+class GitHubAPI:
+    """GitHub API客户端
+
+    GET响应按URL与token缓存在磁盘与内存中, 之后的请求使用ETag进行条件请求,
+    304响应不计入速率限制, 同一进程及同一工作目录下的其他进程可以共享结果。
+    """
+
+    def __init__(self, cache: HTTPCache) -> None:
+        self.cache = cache
+        self.rate_limit = RateLimit()
+        self.memory: dict[str, tuple[str | None, Any]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def headers(token: str | None = None) -> dict[str, str]:
+        headers = dict(API_HEADERS)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    @staticmethod
+    def _cache_key(url: str, token: str | None) -> str:
+        # 不同token可见的内容可能不同, 缓存键中包含token的摘要
+        if not token:
+            return url
+        return f"{url}#{hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]}"
+
+    def request(self, method: str, url: str, token: str | None = None, headers: dict | None = None, **kwargs: Any) -> httpx.Response:
+        """发送请求, 额度不足时先等待, 因额度耗尽被拒绝时等到额度重置后再重试一次"""
+        headers = {**self.headers(token), **(headers or {})}
+        for _ in range(2):
+            self.rate_limit.wait()
+            self.rate_limit.consume()
+            response = request(method, url, headers=headers, **kwargs)
+            self.rate_limit.update(response)
+            if response.status_code not in (403, 429) or response.headers.get("X-RateLimit-Remaining") != "0":
+                break
+            logger.warning("请求%s时GitHub API额度耗尽", url)
+        return response
+
+    def get(self, url: str, token: str | None = None) -> Any:
+        """获取并解析JSON响应, 失败时返回None"""
+        key = self._cache_key(url, token)
+        with self.lock:
+            etag, obj = self.memory.get(key, (None, None))
+        headers = {}
+        meta = None
+        if etag is None and (meta := self.cache.get(key)):
+            headers = self.cache.conditional_headers(meta)
+        elif etag is not None:
+            headers["If-None-Match"] = etag
+
+        try:
+            response = self.request("GET", url, token, headers)
+            if response.status_code == 304:
+                if etag is not None:
+                    logger.debug("GitHub API缓存命中(内存): %s", url)
+                    return obj
+                if meta and (content := self.cache.read(key)) is not None:
+                    logger.debug("GitHub API缓存命中: %s", url)
+                    obj = json.loads(content)
+                    with self.lock:
+                        self.memory[key] = (meta.get("etag"), obj)
+                    return obj
+                response = self.request("GET", url, token)
+            response.raise_for_status()
+            obj = response.json()
+        except Exception as e:
+            logger.error("请求%s失败 %s", url, f"{e.__class__.__name__}: {e!s}")
+            return None
+
+        etag = response.headers.get("ETag")
+        if etag:
+            self.cache.put_bytes(key, response.content, etag, response.headers.get("Last-Modified"), "utf-8")
+            with self.lock:
+                self.memory[key] = (etag, obj)
+        return obj
+
+    def invalidate(self, url: str, token: str | None = None) -> None:
+        """数据被修改后丢弃对应的缓存"""
+        key = self._cache_key(url, token)
+        with self.lock:
+            self.memory.pop(key, None)
+        self.cache.remove(key)
+
+
+_gh_api: GitHubAPI | None = None
+
+
+def get_gh_api() -> GitHubAPI:
+    global _gh_api  # noqa: PLW0603
+    if _gh_api is None:
+        _gh_api = GitHubAPI(HTTPCache(os.path.join(paths.cache, "github")))
+    return _gh_api
+
+
+def gh_api_request(url: str, token: str | None = None) -> dict | None:
+    obj = get_gh_api().get(url, token)
+    if isinstance(obj, dict):
+        return obj
+    return None
+
+
+def get_gh_repo_last_releases(repo: str, token: str | None = None) -> dict | None:
+    return gh_api_request(f"https://api.github.com/repos/{repo}/releases/latest", token)
+
+
+def gh_api_paginate(url: str, item_key: str, token: str | None = None, per_page: int = 100) -> list[dict] | None:
+    """依次请求所有分页并合并item_key中的列表, 任意一页失败时返回None"""
+    items: list[dict] = []
+    page = 1
+    separator = "&" if "?" in url else "?"
+    while True:
+        obj = gh_api_request(f"{url}{separator}per_page={per_page}&page={page}", token)
+        if obj is None or not isinstance(obj.get(item_key), list):
+            return None
+        items.extend(obj[item_key])
+        if len(obj[item_key]) < per_page or len(items) >= obj.get("total_count", float("inf")):
+            return items
+        page += 1
+
+
+def gh_api_delete(url: str, token: str | None = None) -> bool:
+    """删除资源, 资源已经不存在时也视为成功"""
+    try:
+        response = get_gh_api().request("DELETE", url, token)
+    except httpx.HTTPError as e:
+        logger.error("删除%s失败 %s", url, f"{e.__class__.__name__}: {e!s}")
+        return False
+    if response.status_code in (200, 202, 204, 404):
+        return True
+    logger.error("删除%s失败, 状态码: %s", url, response.status_code)
+    return False
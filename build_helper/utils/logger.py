@@ -30,7 +30,7 @@ else:
     debug = False
 logger.addHandler(handler)
 # 文件
-handler = logging.FileHandler(filename=paths.log, encoding="utf-8")
+handler = logging.FileHandler(filename=paths.log, encoding="utf-8", delay=True)
 handler.setFormatter(formatter)
 handler.setLevel(logging.DEBUG)
 logger.addHandler(handler)
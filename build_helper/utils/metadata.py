@@ -0,0 +1,202 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from .logger import logger
+from .paths import paths
+
+# 快照格式变化时修改, 使旧快照失效
+SNAPSHOT_VERSION = 2
+
+
+class PackageInfo:
+    """tmp/.packageinfo中的一个软件包"""
+
+    __slots__ = ("category", "depends", "makefile", "name", "provides", "section", "title", "type", "version")
+
+    def __init__(self, name: str, makefile: str | None) -> None:
+        self.name = name
+        self.makefile = makefile
+        self.version: str | None = None
+        self.section: str | None = None
+        self.category: str | None = None
+        self.title: str | None = None
+        self.depends: str | None = None
+        self.provides: str | None = None
+        self.type: str | None = None
+
+
+class TargetProfile:
+    """tmp/.targetinfo中目标的一个设备配置"""
+
+    __slots__ = ("name", "packages", "supported_devices")
+
+    def __init__(self) -> None:
+        self.name: str | None = None
+        self.packages: list[str] | None = None
+        self.supported_devices: list[str] | None = None
+
+
+class TargetInfo:
+    """tmp/.targetinfo中的一个目标"""
+
+    __slots__ = ("arch", "arch_packages", "board", "default_packages", "feature", "linux_kernel_arch", "linux_release",
+                 "linux_version", "name", "target", "target_profile")
+
+    def __init__(self, target: str) -> None:
+        self.target = target
+        self.board: str | None = None
+        self.name: str | None = None
+        self.arch: str | None = None
+        self.arch_packages: str | None = None
+        self.feature: list[str] | None = None
+        self.linux_version: str | None = None
+        self.linux_release: str | None = None
+        self.linux_kernel_arch: str | None = None
+        self.default_packages: list[str] | None = None
+        self.target_profile: dict[str, TargetProfile] = {}
+
+
+def iter_fields(path: str) -> Iterator[tuple[bytes, str]]:
+    """逐行读取内存映射的文件, 返回"键: 值"形式的行的键与值"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                key, sep, value = line.partition(b": ")
+                if sep:
+                    yield key, value.strip().decode("utf-8", errors="replace")
+
+
+# 这些字段在大量软件包之间重复, 驻留后只保存一份
+PACKAGE_FIELDS = {b"Version": "version", b"Section": "section", b"Category": "category", b"Title": "title", b"Depends": "depends",
+                  b"Provides": "provides", b"Type": "type"}
+PACKAGE_INTERNED_FIELDS = {b"Section", b"Category", b"Type"}
+
+
+def parse_packageinfo(path: str) -> dict[str, PackageInfo]:
+    packages: dict[str, PackageInfo] = {}
+    makefile = None
+    package = None
+    for key, value in iter_fields(path):
+        if key == b"Source-Makefile":
+            makefile = sys.intern(value)
+        elif key == b"Package":
+            package = packages[value] = PackageInfo(value, makefile)
+        elif package is not None and (attr := PACKAGE_FIELDS.get(key)):
+            setattr(package, attr, sys.intern(value) if key in PACKAGE_INTERNED_FIELDS else value)
+    if not packages:
+        msg = "没有获取到任何包信息"
+        raise ValueError(msg)
+    logger.debug("解析出%s个包信息", len(packages))
+    return packages
+
+
+TARGET_FIELDS: dict[bytes, tuple[str, Callable[[str], Any]]] = {
+    b"Target-Board": ("board", sys.intern),
+    b"Target-Name": ("name", str),
+    b"Target-Arch": ("arch", sys.intern),
+    b"Target-Arch-Packages": ("arch_packages", sys.intern),
+    b"Target-Feature": ("feature", lambda value: value.split(" ")),
+    b"Linux-Version": ("linux_version", sys.intern),
+    b"Linux-Release": ("linux_release", sys.intern),
+    b"Linux-Kernel-Arch": ("linux_kernel_arch", sys.intern),
+    b"Default-Packages": ("default_packages", lambda value: [sys.intern(pkg) for pkg in value.split(" ")]),
+}
+PROFILE_FIELDS: dict[bytes, tuple[str, Callable[[str], Any]]] = {
+    b"Target-Profile-Name": ("name", str),
+    b"Target-Profile-Packages": ("packages", lambda value: [sys.intern(pkg) for pkg in value.split(" ")]),
+    b"Target-Profile-SupportedDevices": ("supported_devices", lambda value: value.split(",")),
+}
+
+
+def parse_targetinfo(path: str) -> dict[str, TargetInfo]:
+    targets: dict[str, TargetInfo] = {}
+    target = None
+    profile = None
+    for key, value in iter_fields(path):
+        if key == b"Target":
+            target = targets[value] = TargetInfo(value)
+            profile = None
+        elif target is None:
+            continue
+        elif key == b"Target-Profile":
+            profile = target.target_profile[value] = TargetProfile()
+        elif field := TARGET_FIELDS.get(key):
+            setattr(target, field[0], field[1](value))
+        elif profile is not None and (field := PROFILE_FIELDS.get(key)):
+            setattr(profile, field[0], field[1](value))
+    if not targets:
+        msg = "未解析出目标架构信息"
+        raise ValueError(msg)
+    return targets
+
+
+_loaded: dict[str, tuple[int, int, Any]] = {}
+
+
+def get_snapshot_dir() -> str:
+    snapshot_dir = os.path.join(paths.cache, "metadata")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    return snapshot_dir
+
+
+def prune_snapshots(since: float) -> None:
+    """删除since之后没有使用过的快照, 快照以源文件的摘要命名, 不清理会随配置与源码的变化不断增加"""
+    snapshot_dir = get_snapshot_dir()
+    for name in os.listdir(snapshot_dir):
+        path = os.path.join(snapshot_dir, name)
+        with contextlib.suppress(FileNotFoundError):
+            if os.path.getmtime(path) < since:
+                logger.debug("删除不再使用的快照%s", name)
+                os.remove(path)
+
+
+def load_cached(path: str, parser: Callable[[str], Any]) -> Any:
+    """解析path, 结果按路径缓存在内存中(文件的修改时间或大小变化后失效)
+
+    结果同时以快照保存在缓存目录中, 以源文件的摘要为键, 同一工作区中的其他进程与之后的步骤在源文件内容不变时直接读取快照。
+    OpenWrt源码打包时会删除tmp目录, 因此快照不放在源文件旁。读取快照时更新其修改时间, 没有用到的快照由prune_snapshots删除。
+    """
+    stat = os.stat(path)
+    if (loaded := _loaded.get(path)) and loaded[:2] == (stat.st_mtime_ns, stat.st_size):
+        return loaded[2]
+
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    snapshot_path = os.path.join(get_snapshot_dir(), f"{parser.__name__}-{digest}.pickle")
+    result = None
+    with contextlib.suppress(OSError, pickle.UnpicklingError, EOFError, AttributeError, TypeError, ValueError), open(snapshot_path, "rb") as f:
+        # 快照只由本函数写入工作区内的缓存目录, 不来自下载或其他外部输入, 因此可以用pickle读取
+        version, snapshot = pickle.load(f)  # noqa: S301
+        if version == SNAPSHOT_VERSION:
+            logger.debug("使用%s的快照", path)
+            result = snapshot
+            os.utime(snapshot_path)
+    if result is None:
+        result = parser(path)
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((SNAPSHOT_VERSION, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snapshot_path)
+        except OSError:
+            logger.exception("保存%s的快照失败", path)
+    _loaded[path] = (stat.st_mtime_ns, stat.st_size, result)
+    return result
+
+
+def load_packageinfos(path: str) -> dict[str, PackageInfo]:
+    return load_cached(path, parse_packageinfo)
+
+
+def load_targetinfos(path: str) -> dict[str, TargetInfo]:
+    return load_cached(path, parse_targetinfo)
@@ -0,0 +1,136 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import os
+from collections.abc import Iterable
+from urllib.parse import urlsplit
+
+import pygit2
+
+from .logger import logger
+from .paths import paths
+from .tasks import get_task_group
+
+# Actions缓存中镜像目录的键前缀
+GIT_MIRROR_CACHE_PREFIX = "git-mirrors-"
+# 检出内容标识文件的后缀, 标识文件与检出目录放在同一级目录中
+STAMP_SUFFIX = ".stamp"
+# 远程仓库默认分支在镜像中的引用名
+DEFAULT_BRANCH_REF = "refs/remotes/origin/@default@"
+
+
+class CancellableCallbacks(pygit2.RemoteCallbacks):
+    """所在任务组被取消时中止传输"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.group = get_task_group()
+
+    def transfer_progress(self, stats: pygit2.remotes.TransferProgress) -> None:  # noqa: ARG002
+        self.group.check()
+
+
+def fetch_refs(repo: pygit2.Repository, names: Iterable[str], depth: int = 1) -> None:
+    """只获取远程仓库origin中名为names的分支或标签, 同名时分支优先, 与OpenWrt.set_tag_or_branch的查找顺序一致"""
+    remote = repo.remotes["origin"]
+    advertised = {head.name for head in remote.list_heads()}
+    refspecs = []
+    for name in sorted(set(names)):
+        for ref in (f"refs/heads/{name}", f"refs/tags/{name}"):
+            if ref in advertised:
+                refspecs.append(f"+{ref}:{ref}")
+                break
+        else:
+            msg = f"远程仓库{remote.url}中不存在分支或标签{name}"
+            raise ValueError(msg)
+    logger.debug("从%s获取%s(depth=%s)", remote.url, refspecs, depth)
+    remote.fetch(refspecs, depth=depth, callbacks=CancellableCallbacks())
+
+
+class GitMirror:
+    """以裸仓库保存的远程仓库镜像
+
+    镜像目录可以在运行之间缓存, 之后只需增量获取分支的最新提交(depth=1),
+    检出时只从对象库中写出需要的目录。
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def get_path(self, url: str) -> str:
+        parsed = urlsplit(url)
+        return os.path.join(self.root, parsed.netloc, parsed.path.strip("/").removesuffix(".git") + ".git")
+
+    def open(self, url: str) -> pygit2.Repository:
+        path = self.get_path(url)
+        if os.path.exists(os.path.join(path, "HEAD")):
+            repo = pygit2.Repository(path)
+            if repo.remotes["origin"].url != url:
+                repo.remotes.set_url("origin", url)
+            return repo
+        repo = pygit2.init_repository(path, bare=True)
+        repo.remotes.create("origin", url)
+        return repo
+
+    def fetch(self, repo: pygit2.Repository, url: str, branch: str | None) -> pygit2.Commit:
+        """获取分支(为空时为远程仓库的默认分支)的最新提交"""
+        remote = repo.remotes["origin"]
+        if branch:
+            remote_ref = f"refs/heads/{branch}"
+            local_ref = f"refs/remotes/origin/{branch}"
+        else:
+            heads = {head.name: head for head in remote.list_heads()}
+            if "HEAD" not in heads or not heads["HEAD"].symref_target:
+                msg = f"无法获取仓库{url}的默认分支"
+                raise ValueError(msg)
+            remote_ref = heads["HEAD"].symref_target
+            local_ref = DEFAULT_BRANCH_REF
+        remote.fetch([f"+{remote_ref}:{local_ref}"], depth=1, callbacks=CancellableCallbacks())
+        return repo.references[local_ref].peel(pygit2.Commit)
+
+    @staticmethod
+    def read_stamp(path: str) -> str | None:
+        """获取path中检出内容的标识(树对象id与检出的目录), 没有检出过时返回None"""
+        try:
+            with open(path + STAMP_SUFFIX, encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def stamp_paths(path: str, derived: Iterable[str] = ()) -> list[str]:
+        """path的检出标识文件与derived(后缀)对应的处理标识文件"""
+        return [path + suffix + STAMP_SUFFIX for suffix in ("", *derived)]
+
+    def checkout(self, url: str, branch: str | None, path: str, subdirs: set[str] | None = None, derived: Iterable[str] = ()) -> str:
+        """将分支的最新提交检出到path, 指定subdirs时只检出这些目录, 返回检出内容的标识
+
+        标识保存在path旁的文件中, 已经检出过相同内容时跳过检出。
+        derived为检出后对内容进行处理的标识文件的后缀, 实际检出时这些标识一并删除, 使处理重新进行。
+        """
+        repo = self.open(url)
+        commit = self.fetch(repo, url, branch)
+        stamp = f"{commit.tree_id} {' '.join(sorted(subdirs)) if subdirs else '*'}"
+        if os.path.isdir(path) and self.read_stamp(path) == stamp:
+            logger.debug("%s已检出%s@%s, 跳过", path, url, commit.id)
+            return stamp
+        for stamp_path in self.stamp_paths(path, derived):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stamp_path)
+        os.makedirs(path, exist_ok=True)
+        logger.debug("检出%s@%s到%s, 目录: %s", url, commit.id, path, sorted(subdirs) if subdirs else "全部")
+        repo.checkout_tree(commit.tree, directory=path, paths=sorted(subdirs) if subdirs else None,
+                           strategy=pygit2.enums.CheckoutStrategy.FORCE)
+        with open(path + STAMP_SUFFIX, "w", encoding="utf-8") as f:
+            f.write(stamp)
+        return stamp
+
+
+_git_mirror: GitMirror | None = None
+
+
+def get_git_mirror() -> GitMirror:
+    global _git_mirror  # noqa: PLW0603
+    if _git_mirror is None:
+        _git_mirror = GitMirror(os.path.join(paths.cache, "git"))
+    return _git_mirror
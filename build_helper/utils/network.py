@@ -1,9 +1,16 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
-import json
+import os
+import random
+import threading
+import time
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from typing import Any
 
 import httpx
 
+from .cache import get_http_cache
 from .logger import logger
 
 HEADER = {
@@ -13,32 +20,130 @@ HEADER = {
     "cache-control": "no-cache",
 }
 
+TIMEOUT = httpx.Timeout(10, read=30)
+# 指数退避的基数与单次等待上限(秒)
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+# 这些状态码表示服务器暂时不可用, 可以重试
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
 
-def request_get(url: str, retry: int = 6, headers: dict | None = None) -> str | None:
-    for i in range(retry):
+
+class HostStats:
+    """单个主机的请求次数、失败次数与延迟统计"""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, latency: float, ok: bool) -> None:
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0.0
+
+
+host_stats: dict[str, HostStats] = {}
+_client: httpx.Client | None = None
+_client_pid = 0
+_lock = threading.Lock()
+
+
+def get_client() -> httpx.Client:
+    """获取进程内共享的HTTP客户端, fork出的子进程会重新创建"""
+    global _client, _client_pid  # noqa: PLW0603
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = httpx.Client(http2=True, follow_redirects=True, timeout=TIMEOUT,
+                                   limits=httpx.Limits(max_connections=32, max_keepalive_connections=16))
+            _client_pid = os.getpid()
+        return _client
+
+
+def _record(host: str, latency: float, ok: bool) -> None:
+    with _lock:
+        if host not in host_stats:
+            host_stats[host] = HostStats()
+        host_stats[host].add(latency, ok)
+
+
+def get_retry_after(response: httpx.Response) -> float | None:
+    """解析Retry-After响应头(秒数或HTTP日期)"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, retry_after: float | None = None) -> float:
+    """计算重试前的等待时间, 优先遵循Retry-After, 否则使用带随机抖动的指数退避"""
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))  # noqa: S311
+
+
+def request(method: str, url: str, retry: int = 6, headers: dict | None = None, **kwargs: Any) -> httpx.Response:
+    """使用共享客户端发送请求
+
+    网络错误、429与5xx响应会按指数退避重试, 重试次数用完后返回最后一次的响应或抛出最后一次的异常。
+    """
+    client = get_client()
+    host = httpx.URL(url).host
+    for attempt in range(retry):
+        start = time.monotonic()
         try:
-            response = httpx.get(url, timeout=10, follow_redirects=True, headers=headers)
-            response.raise_for_status()
-            return response.text  # noqa: TRY300
-        except Exception as e:
-            logger.warning(f"请求{url}失败， 重试次数：{i + 1}")
-            error = e
-    logger.error("请求失败，重试次数已用完 %s", f"{error.__class__.__name__}: {error!s}")
-    return None
+            response = client.request(method, url, headers=headers, **kwargs)
+        except httpx.TransportError as e:
+            _record(host, time.monotonic() - start, ok=False)
+            if attempt == retry - 1:
+                raise
+            delay = backoff(attempt)
+            logger.warning("请求%s失败(%s), %.1f秒后重试, 重试次数：%s", url, f"{e.__class__.__name__}: {e!s}", delay, attempt + 1)
+            time.sleep(delay)
+            continue
+        _record(host, time.monotonic() - start, ok=response.status_code < 500)
+        retryable = (response.status_code in RETRY_STATUS_CODES or
+                     (response.status_code == 403 and "Retry-After" in response.headers))
+        if not retryable or attempt == retry - 1:
+            return response
+        delay = backoff(attempt, get_retry_after(response))
+        logger.warning("请求%s返回%s, %.1f秒后重试, 重试次数：%s", url, response.status_code, delay, attempt + 1)
+        time.sleep(delay)
+    msg = "retry必须大于0"
+    raise ValueError(msg)
+
+
+def log_host_stats() -> None:
+    for host, stats in sorted(host_stats.items()):
+        logger.debug("主机%s: 请求%s次, 失败%s次, 平均延迟%.3f秒, 最大延迟%.3f秒",
+                     host, stats.requests, stats.errors, stats.avg_latency, stats.max_latency)
+
 
-def get_gh_repo_last_releases(repo: str, token: str | None = None) -> dict | None:
-    return gh_api_request(f"https://api.github.com/repos/{repo}/releases/latest", token)
-
-def gh_api_request(url: str, token: str | None = None) -> dict | None:
-    headers = {
-                "Accept": "application/vnd.github+json",
-                "X-GitHub-Api-Version": "2022-11-28",
-                }
-    if token:
-        headers["Authorization"] = f'Bearer {token}'
-    response = request_get(url, headers=headers)
-    if isinstance(response, str):
-        obj = json.loads(response)
-        if isinstance(obj, dict):
-            return obj
+def request_get(url: str, retry: int = 6, headers: dict | None = None, cache: bool = True) -> str | None:
+    http_cache = get_http_cache() if cache else None
+    meta = http_cache.get(url) if http_cache else None
+    if http_cache and meta:
+        headers = {**(headers or {}), **http_cache.conditional_headers(meta)}
+    try:
+        response = request("GET", url, retry, headers)
+        if response.status_code == 304 and http_cache and meta and (content := http_cache.read(url)) is not None:
+            logger.info("缓存命中: %s", url)
+            return content.decode(meta.get("encoding") or "utf-8", errors="replace")
+        response.raise_for_status()
+        if http_cache:
+            http_cache.put_bytes(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"), response.encoding)
+        return response.text  # noqa: TRY300
+    except Exception as e:
+        logger.error("请求%s失败 %s", url, f"{e.__class__.__name__}: {e!s}")
     return None
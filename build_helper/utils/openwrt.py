@@ -5,61 +5,109 @@ import re
 import shutil
 import subprocess
 import tarfile
+import time
+from collections.abc import Iterable
 from typing import Literal
 
 import pygit2
 from actions_toolkit import core
 
+from .depgraph import DependencyGraph
 from .logger import logger
+from .metadata import PackageInfo, TargetInfo, load_packageinfos, load_targetinfos
 from .network import request_get
+from .tasks import run_command
 from .utils import apply_patch
 
 
+class ConfigIndex:
+    """解析后的.config, 符号(不含CONFIG_前缀)到值的映射
+
+    字符串值去掉引号, "# CONFIG_XXX is not set"记为"n", 字典保持文件中的顺序。
+    """
+
+    ASSIGN_PATTERN = re.compile(r'^CONFIG_(?P<name>[^=\s]+)=(?P<value>.*)$')
+    NOT_SET_PATTERN = re.compile(r'^# CONFIG_(?P<name>\S+) is not set$')
+
+    def __init__(self, path: str) -> None:
+        stat = os.stat(path)
+        self.mtime, self.size = stat.st_mtime_ns, stat.st_size
+        self.symbols: dict[str, str] = {}
+        with open(path) as f:
+            for line in f:
+                line = line.rstrip("\n")  # noqa: PLW2901
+                if match := self.ASSIGN_PATTERN.match(line):
+                    value = match.group("value")
+                    if len(value) >= 2 and value[0] == value[-1] == '"':
+                        value = value[1:-1]
+                    self.symbols[match.group("name")] = value
+                elif match := self.NOT_SET_PATTERN.match(line):
+                    self.symbols[match.group("name")] = "n"
+
+    def get(self, name: str) -> str | None:
+        return self.symbols.get(name)
+
+    def is_set(self, name: str) -> bool:
+        return self.symbols.get(name, "n") != "n"
+
+    def match(self, pattern: re.Pattern, value: str | None = None) -> list[re.Match]:
+        """按文件中的顺序返回匹配pattern(且值为value)的符号的匹配结果"""
+        return [match for name, symbol_value in self.symbols.items()
+                if (value is None or symbol_value == value) and (match := pattern.fullmatch(name))]
+
+
+_config_indexes: dict[str, ConfigIndex] = {}
+
+
+def get_config_index(path: str) -> ConfigIndex | None:
+    """获取.config的索引, 按路径缓存, 文件的修改时间或大小变化后重新解析, 文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _config_indexes.pop(path, None)
+        return None
+    index = _config_indexes.get(path)
+    if index is None or index.mtime != stat.st_mtime_ns or index.size != stat.st_size:
+        index = _config_indexes[path] = ConfigIndex(path)
+    return index
+
+
+def invalidate_config_index(path: str) -> None:
+    """写入.config后调用, 避免修改时间精度不足时读到旧的索引"""
+    _config_indexes.pop(path, None)
+
+
 class OpenWrtBase:
     def __init__(self, path: str) -> None:
         self.path = path
         self.files = os.path.join(path, 'files')
 
+    @property
+    def config_path(self) -> str:
+        return os.path.join(self.path, '.config')
+
+    def get_config_index(self) -> ConfigIndex | None:
+        return get_config_index(self.config_path)
+
     def get_arch(self) -> tuple[str | None, str | None]:
         arch = None
         version = None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith('CONFIG_ARCH='):
-                        match = re.match(r'^CONFIG_ARCH="(?P<arch>.*)"$', line)
-                        if match:
-                            arch = match.group("arch")
-                    elif line.startswith('CONFIG_arm_'):
-                        match = re.match(r'^CONFIG_arm_(?P<ver>[0-9]+)=y$', line)
-                        if match:
-                            version = match.group("ver")
-
-                    if arch and version:
-                        break
+        if index := self.get_config_index():
+            arch = index.get("ARCH")
+            if matches := index.match(re.compile(r'arm_(?P<ver>[0-9]+)'), "y"):
+                version = matches[0].group("ver")
         logger.debug("仓库%s的架构为%s,版本为%s", self.path, arch, version)
         return arch, version
 
     def apply_config(self, config: str) -> None:
-        with open(os.path.join(self.path, '.config'), 'w') as f:
+        with open(self.config_path, 'w') as f:
             f.write(config)
+        invalidate_config_index(self.config_path)
 
     def get_target(self) -> tuple[str | None, str | None]:
-        target, subtarget = None, None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith('CONFIG_TARGET_BOARD='):
-                        match = re.match(r'^CONFIG_TARGET_BOARD="(?P<target>.*)"$', line)
-                        if match:
-                            target = match.group("target")
-                    elif line.startswith('CONFIG_TARGET_SUBTARGET='):
-                        match = re.match(r'^CONFIG_TARGET_SUBTARGET="(?P<subtarget>.*)"$', line)
-                        if match:
-                            subtarget = match.group("subtarget")
-                    if target and subtarget:
-                        return target, subtarget
-        return target, subtarget
+        if index := self.get_config_index():
+            return index.get("TARGET_BOARD"), index.get("TARGET_SUBTARGET")
+        return None, None
 
     def make(self, target: str, debug: bool = False) -> None:
         args = ['make', target]
@@ -78,55 +126,87 @@ class OpenWrtBase:
             else:
                 logger.error("编译失败，请检查错误信息")
                 raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+
+
+# enable_kmods最多运行make defconfig的次数
+KMOD_MAX_PASSES = 5
+
+
+def resolve_tag_or_branch(repo: pygit2.Repository, tag_branch: str) -> pygit2.Commit:
+    """获取分支或标签指向的提交, 依次查找本地分支、远程分支与标签"""
+    for ref in (f"refs/heads/{tag_branch}", f"refs/remotes/origin/{tag_branch}", f"refs/tags/{tag_branch}"):
+        if ref in repo.references:
+            return repo.references[ref].peel(pygit2.Commit)
+    msg = f"分支或标签{tag_branch}不存在"
+    raise ValueError(msg)
+
+
 class OpenWrt(OpenWrtBase):
     def __init__(self, path: str, tag_branch: str | None = None) -> None:
         super().__init__(path)
-        if os.path.isdir(os.path.join(path, ".git")):
+        # 工作树中的.git是指向对象库的文件
+        if os.path.exists(os.path.join(path, ".git")):
             self.repo = pygit2.Repository(self.path)
             if tag_branch:
                 self.set_tag_or_branch(tag_branch)
         else:
             self.repo = None
 
+    @classmethod
+    def from_store(cls, store: pygit2.Repository, name: str, path: str, tag_branch: str) -> "OpenWrt":
+        """从共享的裸仓库创建名为name的工作树并检出tag_branch, 多个工作树共用同一个对象库"""
+        commit = resolve_tag_or_branch(store, tag_branch)
+        # 重复运行时对象库中会留下上次的工作树记录(remove_git只删除工作树中的.git文件), 需要先清除记录与旧的工作树目录
+        if name in store.list_worktrees():
+            store.lookup_worktree(name).prune(True)
+        if os.path.lexists(path):
+            shutil.rmtree(path)
+        # 同一分支不能同时被多个工作树检出, 为每个工作树创建单独的分支
+        branch = store.branches.local.create(f"openwrt-k/{name}", commit, force=True)
+        store.add_worktree(name, path, branch)
+        openwrt = cls(path)
+        openwrt.tag_branch = tag_branch
+        return openwrt
+
     def set_tag_or_branch(self, tag_branch: str) -> None:
         if not self.repo:
             msg = "没有找到git仓库"
             raise ValueError(msg)
-        if tag_branch in self.repo.branches:
-            # 分支
-            self.repo.checkout(tag_branch)
-        else:
-            # 标签
-            tag_ref = self.repo.lookup_reference(f"refs/tags/{tag_branch}")
-            treeish = self.repo.get(tag_ref.target)
-            if treeish:
-                self.repo.checkout_tree(treeish)
-                self.repo.head.set_target(tag_ref.target)
-            else:
-                msg = f"标签{tag_branch}不存在"
-                raise ValueError(msg)
+        commit = resolve_tag_or_branch(self.repo, tag_branch)
+        self.repo.checkout_tree(commit)
+        self.repo.set_head(commit.id)
 
         self.tag_branch = tag_branch
 
+    def remove_git(self) -> None:
+        """删除.git, 工作树中的.git是文件"""
+        git_path = os.path.join(self.path, ".git")
+        if os.path.isdir(git_path) and not os.path.islink(git_path):
+            shutil.rmtree(git_path)
+        elif os.path.lexists(git_path):
+            os.remove(git_path)
+        self.repo = None
+
     def feed_update(self) -> None:
-        result = subprocess.run([os.path.join(self.path, "scripts", "feeds"), 'update', '-a'], cwd=self.path, capture_output=True, text=True)
+        result = run_command([os.path.join(self.path, "scripts", "feeds"), 'update', '-a'], cwd=self.path, capture_output=True, text=True)
         if result.returncode != 0:
             logger.error("运行命令：scripts/feeds update -a失败\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
             raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
         logger.debug("运行命令：scripts/feeds update -a成功\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
 
     def feed_install(self) -> None:
-        result = subprocess.run([os.path.join(self.path, "scripts", "feeds"), 'install', '-a'], cwd=self.path, capture_output=True, text=True)
+        result = run_command([os.path.join(self.path, "scripts", "feeds"), 'install', '-a'], cwd=self.path, capture_output=True, text=True)
         if result.returncode != 0:
             logger.error("运行命令：scripts/feeds install -a失败\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
             raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
         logger.debug("运行命令：scripts/feeds install -a成功\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
 
     def make_defconfig(self) -> None:
-        result = subprocess.run(['make', 'defconfig'], cwd=self.path, capture_output=True, text=True)
+        result = run_command(['make', 'defconfig'], cwd=self.path, capture_output=True, text=True)
         if result.returncode != 0:
             logger.error("运行命令：make defconfig失败\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
             raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        invalidate_config_index(self.config_path)
         logger.debug("运行命令：make defconfig成功\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
 
     def make_download(self, debug: bool = False, taget: str = "download") -> None:
@@ -153,40 +233,45 @@ class OpenWrt(OpenWrtBase):
 
     def get_kernel_version(self) -> str | None:
         kernel_version = None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith('CONFIG_LINUX_'):
-                        match = re.match(r'^CONFIG_LINUX_(?P<major>[0-9]+)_(?P<minor>[0-9]+)=y$', line)
-                        if match:
-                            kernel_version = f"{match.group("major")}.{match.group("minor")}"
-                            break
+        if (index := self.get_config_index()) and (matches := index.match(re.compile(r'LINUX_(?P<major>[0-9]+)_(?P<minor>[0-9]+)'), "y")):
+            kernel_version = f"{matches[0].group("major")}.{matches[0].group("minor")}"
         logger.debug("配置%s的内核版本为%s", self.path, kernel_version)
         return kernel_version
 
-    def get_package_config(self, package: str) -> Literal["y", "n", "m"] | None:
-        package_config = None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith(f'CONFIG_PACKAGE_{package}='):
-                        match = re.match(fr'^CONFIG_PACKAGE_{package}=(?P<config>[ymn])$', line)
-                        if match:
-                            package_config = match.group("config")
-                            if  package_config in ("y", "n", "m"):
-                                break
-                            package_config = None
-        else:
+    def get_package_configs(self, packages: Iterable[str]) -> dict[str, Literal["y", "n", "m"] | None]:
+        """一次获取多个软件包的配置, 未出现在配置中的软件包为None"""
+        index = self.get_config_index()
+        if index is None:
             logger.warning("仓库%s的配置文件不存在", self.path)
-        logger.debug("仓库%s的软件包%s的配置为%s", self.path, package, package_config)
-        return package_config # type: ignore[]
+        package_configs = {}
+        for package in packages:
+            package_config = index.get(f"PACKAGE_{package}") if index else None
+            package_configs[package] = package_config if package_config in ("y", "n", "m") else None
+        logger.debug("仓库%s的软件包配置为%s", self.path, package_configs)
+        return package_configs  # type: ignore[return-value]
+
+    def get_package_config(self, package: str) -> Literal["y", "n", "m"] | None:
+        return self.get_package_configs([package])[package]
+
+    def get_dependency_graph(self) -> DependencyGraph:
+        return DependencyGraph(self.get_packageinfos())
 
     def check_package_dependencies(self) -> bool:
-        subprocess.run(['gmake', '-s', 'prepare-tmpinfo'], cwd=self.path)
-        if err := subprocess.run(['./scripts/package-metadata.pl', 'mk', 'tmp/.packageinfo'], cwd=self.path, capture_output=True, text=True).stderr:
-            core.error(f'检查到软件包依赖问题,这有可能会导致编译错误:\n{err}')
-            return False
-        return True
+        """检查.config中选中的软件包是否缺少依赖或存在循环依赖, 每个问题单独报告"""
+        start = time.perf_counter()
+        graph = self.get_dependency_graph()
+        index = self.get_config_index()
+        symbols = index.symbols if index else None
+        selected = [name for name in graph.packages if symbols is None or symbols.get(f"PACKAGE_{name}") in ("y", "m")]
+        ok = True
+        for name, dependencies in graph.find_missing(selected, symbols).items():
+            core.error(f'软件包{name}依赖的{", ".join(map(str, dependencies))}不存在,这有可能会导致编译错误')
+            ok = False
+        for cycle in graph.find_cycles(selected):
+            core.warning(f'检查到软件包循环依赖: {" <-> ".join(cycle)}')
+            ok = False
+        logger.debug("检查%s个软件包的依赖, 耗时%.1f毫秒", len(selected), (time.perf_counter() - start) * 1000)
+        return ok
 
     def fix_problems(self) -> None:
         if self.tag_branch.startswith("v") and self.tag_branch[1:3].isdigit() and int(self.tag_branch[1:3]) < 24:
@@ -239,79 +324,14 @@ class OpenWrt(OpenWrtBase):
         #    if not apply_patch(f.read(), self.path):
         #        core.error("修复bcm27xx-gpu-fw失败, 这可能会导致生成镜像生成器错误。")
 
-    def get_packageinfos(self) -> dict:
+    def get_packageinfos(self) -> dict[str, PackageInfo]:
         path = os.path.join(self.path, "tmp", ".packageinfo")
         if not os.path.exists(path):
             self.make_defconfig()
-
-        packages = {}
-
-        makefile = None
-        package = None
-        version = None
-        section = None
-        category = None
-        title = None
-        depends = None
-        type_ = None
-
-        count = 0
-        with open(path, encoding='utf-8') as f:
-            for line in f:
-                if line.startswith("Source-Makefile: "):
-                    makefile = line.split("Source-Makefile: ")[1].strip()
-                if line.startswith("Package: "):
-                    if count != 0:
-                        packages[package] = {
-                            "makefile": makefile,
-                            "version": version,
-                            "section": section,
-                            "category": category,
-                            "title": title,
-                            "depends": depends,
-                            "type": type_,
-                        }
-                    package = line.split("Package: ")[1].strip()
-                    version = None
-                    section = None
-                    category = None
-                    title = None
-                    depends = None
-                    type_ = None
-                    count += 1
-                elif line.startswith("Version: "):
-                    version = line.split("Version: ")[1].strip()
-                elif line.startswith("Section: "):
-                    section = line.split("Section: ")[1].strip()
-                elif line.startswith("Category: "):
-                    category = line.split("Category: ")[1].strip()
-                elif line.startswith("Title: "):
-                    title = line.split("Title: ")[1].strip()
-                elif line.startswith("Depends: "):
-                    depends = line.split("Depends: ")[1].strip()
-                elif line.startswith("Type: "):
-                    type_ = line.split("Type: ")[1].strip()
-
-            if package and package not in packages:
-                packages[package] = {
-                    "makefile": makefile,
-                    "version": version,
-                    "section": section,
-                    "category": category,
-                    "title": title,
-                    "depends": depends,
-                    "type": type_,
-                }
-
-        if count == 0:
-            msg = "没有获取到任何包信息"
-            raise ValueError(msg)
-        logger.debug("解析出%s个包信息", count)
-        return packages
+        return load_packageinfos(path)
 
     def archive(self, path: str) -> None:
-        if os.path.exists(os.path.join(self.path, ".git")):
-            shutil.rmtree(os.path.join(self.path, ".git"))
+        self.remove_git()
         if os.path.exists(os.path.join(self.path, "tmp")):
             shutil.rmtree(os.path.join(self.path, "tmp"))
         if os.path.exists(os.path.join(self.path, "dl")):
@@ -319,147 +339,87 @@ class OpenWrt(OpenWrtBase):
         with tarfile.open(path, "w:gz") as tar:
             tar.add(self.path, arcname="openwrt")
 
-    def get_targetinfos(self) -> dict:
+    def get_targetinfos(self) -> dict[str, TargetInfo]:
         path = os.path.join(self.path, "tmp", ".targetinfo")
         if not os.path.exists(path):
             self.make_defconfig()
+        return load_targetinfos(path)
 
-        targets = {}
-
-        target = None
-        board = None
-        name = None
-        arch = None
-        arch_packages = None
-        feature = None
-        linux_version = None
-        linux_release = None
-        linux_kernel_arch = None
-        default_packages = None
-        target_profile = {}
-
-        count = 0
-        with open(path) as f:
-            for line in f:
-                if line.startswith("Target: "):
-                    if count != 0:
-                        targets[target] = {
-                            "board": board,
-                            "name": name,
-                            "arch": arch,
-                            "arch_packages": arch_packages,
-                            "feature": feature,
-                            "linux_version": linux_version,
-                            "linux_release": linux_release,
-                            "linux_kernel_arch": linux_kernel_arch,
-                            "default_packages": default_packages,
-                            "target_profile": target_profile,
-                        }
-                    target = line.split("Target: ")[1].strip()
-                    board = None
-                    name = None
-                    arch = None
-                    arch_packages = None
-                    feature = None
-                    linux_version = None
-                    linux_release = None
-                    linux_kernel_arch = None
-                    default_packages = None
-                    target_profile = {}
-                    count += 1
-                elif line.startswith("Target-Board: "):
-                    board = line.split("Target-Board: ")[1].strip()
-                elif line.startswith("Target-Name: "):
-                    name = line.split("Target-Name: ")[1].strip()
-                elif line.startswith("Target-Arch: "):
-                    arch = line.split("Target-Arch: ")[1].strip()
-                elif line.startswith("Target-Arch-Packages: "):
-                    arch_packages = line.split("Target-Arch-Packages: ")[1].strip()
-                elif line.startswith("Target-Feature: "):
-                    feature = line.split("Target-Feature: ")[1].strip().split(" ")
-                elif line.startswith("Linux-Version: "):
-                    linux_version = line.split("Linux-Version: ")[1].strip()
-                elif line.startswith("Linux-Release: "):
-                    linux_release = line.split("Linux-Release: ")[1].strip()
-                elif line.startswith("Linux-Kernel-Arch: "):
-                    linux_kernel_arch = line.split("Linux-Kernel-Arch: ")[1].strip()
-                elif line.startswith("Default-Packages: "):
-                    default_packages = line.split("Default-Packages: ")[1].strip().split(" ")
-                elif line.startswith("Target-Profile: "):
-                    target_profile[line.split("Target-Profile: ")[1].strip()] = {}
-                elif line.startswith("Target-Profile-Name: "):
-                    target_profile[list(target_profile.keys())[-1]]["name"] = line.split("Target-Profile-Name: ")[1].strip()
-                elif line.startswith("Target-Profile-Packages: "):
-                    target_profile[list(target_profile.keys())[-1]]["packages"] = line.split("Target-Profile-Packages: ")[1].strip().split(" ")
-                elif line.startswith("Target-Profile-SupportedDevices: "):
-                    target_profile[list(target_profile.keys())[-1]]["supported_devices"] = line.split("Target-Profile-SupportedDevices: ")[1].strip().split(",")
-
-            if target and target not in targets:
-                targets[target] = {
-                    "board": board,
-                    "name": name,
-                    "arch": arch,
-                    "arch_packages": arch_packages,
-                    "feature": feature,
-                    "linux_version": linux_version,
-                    "linux_release": linux_release,
-                    "linux_kernel_arch": linux_kernel_arch,
-                    "default_packages": default_packages,
-                    "target_profile": target_profile,
-                }
-        if count == 0:
-            msg = "未解析出目标架构信息"
-            raise ValueError(msg)
-        return targets
-
-    def get_targetinfo(self) -> dict | None:
+    def get_targetinfo(self) -> TargetInfo | None:
         targets = self.get_targetinfos()
-        targetinfos = None
-        with open(os.path.join(self.path, ".config")) as f:
-            for line in f:
-                if match := re.match(r"CONFIG_TARGET_(?P<target>[^=]+)=", line):
-                    target = match.group('target').replace("_", "/")
-                    targetinfos = targets.get(target, targetinfos)
-                    if targetinfos and target:
-                        targetinfos["target"] = target
-        return targetinfos
-
-    def enable_kmods(self, exclude_list: list[str], only_kmods: bool = False) -> None:
+        targetinfo = None
+        index = self.get_config_index()
+        for name, value in index.symbols.items() if index else ():
+            if name.startswith("TARGET_") and value != "n":
+                targetinfo = targets.get(name.removeprefix("TARGET_").replace("_", "/"), targetinfo)
+        return targetinfo
+
+    def rewrite_config(self, changes: dict[str, str | None]) -> None:
+        """一次性修改.config中的软件包符号, 值为None时删除该行(由defconfig重新决定)"""
+        with open(self.config_path) as f:
+            lines = f.read().splitlines()
+        with open(self.config_path, "w") as f:
+            for line in lines:
+                if "CONFIG_PACKAGE_" in line and (match := ConfigIndex.ASSIGN_PATTERN.match(line) or ConfigIndex.NOT_SET_PATTERN.match(line)):
+                    name = match.group("name")
+                    if name in changes:
+                        if (value := changes[name]) is not None:
+                            f.write(f"CONFIG_{name}={value}\n")
+                        continue
+                f.write(line + "\n")
+        invalidate_config_index(self.config_path)
+
+    def enable_kmods(self, exclude_list: list[str], only_kmods: bool = False) -> int:
+        """启用所有kmod(only_kmods时同时取消编译非必要的软件包), 返回运行make defconfig的次数
+
+        启用kmod后defconfig可能使更多kmod可见, 因此每轮都重新检查所有符号, 直到没有需要修改的符号,
+        或者一轮make defconfig后配置与这一轮开始时相同(修改全部被defconfig改回, 再运行也是同样的结果), 最多KMOD_MAX_PASSES次。
+        """
+        # exclude_list为空时与原来一样匹配所有kmod(空正则表达式), 即不启用任何kmod
         exclude_pattern = re.compile(r"|".join(exclude_list))
         packages = self.get_packageinfos()
-        kmods = [package for package in packages if (packages[package]["section"] == "kernel" or packages[package]["category"] == "Kernel modules")]
+        kmods = {name for name, package in packages.items() if package.section == "kernel" or package.category == "Kernel modules"}
         logger.debug("获取到kmods: %s", kmods)
         targetinfo = self.get_targetinfo()
-        if targetinfo:
-            default_packages = targetinfo["default_packages"]
-            logger.debug("获取到默认包: %s", default_packages)
+        default_packages = set(targetinfo.default_packages or ()) if targetinfo else set()
+        logger.debug("获取到默认包: %s", default_packages)
+        removable = {name for name, package in packages.items()
+                     if (package.section not in ("kernel", "base", "boot", "firmware", "sys", "system") and
+                         package.category not in ("Boot Loaders", "Firmware", "Base system", "Kernel modules", "System") and
+                         name not in default_packages)} if only_kmods else set()
+
+        previous: dict[str, str] | None = None
+        passes = 0
+        while passes < KMOD_MAX_PASSES:
+            index = self.get_config_index()
+            if index is None:
+                msg = f"仓库{self.path}的配置文件不存在"
+                raise FileNotFoundError(msg)
+            if index.symbols == previous:
+                logger.debug("make defconfig撤销了上一轮的所有修改, 配置不再变化")
+                break
+            changes: dict[str, str | None] = {}
+            for symbol, value in index.symbols.items():
+                if not symbol.startswith("PACKAGE_"):
+                    continue
+                name = symbol.removeprefix("PACKAGE_")
+                if value == "n" and name in kmods and not exclude_pattern.match(name):
+                    changes[symbol] = "m"
+                elif value in ("y", "m") and name in removable:
+                    logger.debug("取消编译包: %s", name)
+                    changes[symbol] = None
+            if not changes:
+                break
+            logger.debug("第%s轮修改%s个软件包的配置", passes + 1, len(changes))
+            previous = dict(index.symbols)
+            self.rewrite_config(changes)
+            self.make_defconfig()
+            passes += 1
         else:
-            default_packages = []
-
-        for _ in range(5):
-            with open(os.path.join(self.path, ".config")) as f:
-             config = f.read()
-            with open(os.path.join(self.path, ".config"), "w") as f:
-                for line in config.splitlines():
-                    if match := re.match(r"# CONFIG_PACKAGE_(?P<name>[^ ]+) is not set", line):
-                        name = match.group('name')
-                        if not exclude_pattern.match(name) and name in kmods:
-                            f.write(f"CONFIG_PACKAGE_{name}=m\n")
-                        else:
-                            f.write(line + "\n")
-                    elif only_kmods and (match := re.match(r"CONFIG_PACKAGE_(?P<name>[^=]+)=[ym]", line)):
-                        name = match.group('name')
-                        package = packages.get(name)
-                        if package and (package["section"] not in ("kernel", "base", "boot", "firmware", "sys", "system") and
-                                        package["category"] not in ("Boot Loaders", "Firmware", "Base system", "Kernel modules", "System") and
-                                        package not in default_packages):
-                            logger.debug("取消编译包: %s", name)
-                            continue
-                        f.write(line + "\n")
-                    else:
-                        f.write(line + "\n")
-                self.make_defconfig()
+            logger.warning("运行%s次make defconfig后配置仍在变化", KMOD_MAX_PASSES)
+        logger.info("启用所有kmod, 共运行%s次make defconfig", passes)
         logger.debug("启用所有kmod, 配置差异: %s", self.get_diff_config())
+        return passes
 
     def __getstate__(self) -> dict:
         state = self.__dict__.copy()
@@ -468,7 +428,7 @@ class OpenWrt(OpenWrtBase):
 
     def __setstate__(self, state: dict) -> None:
         self.__dict__.update(state)
-        if os.path.isdir(os.path.join(self.path, ".git")):
+        if os.path.exists(os.path.join(self.path, ".git")):
             self.repo = pygit2.Repository(self.path)
         else:
             self.repo = None
@@ -65,6 +65,16 @@ class Paths:
             raise NotADirectoryError(msg)
         return uploads
 
+    @property
+    def cache(self) -> str:
+        cache = os.path.join(self.workdir, "cache")
+        if not os.path.exists(cache):
+            os.makedirs(cache)
+        elif not os.path.isdir(cache):
+            msg = f"缓存路径 {cache} 不是一个目录"
+            raise NotADirectoryError(msg)
+        return cache
+
     @property
     def log(self) -> str:
         return os.path.join(self.build_helper, "build_helper.log")
@@ -1,30 +1,66 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
-import contextlib
+import functools
 import os
+import re
+import threading
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
 
 import github
 import github.GitRelease
-import httpx
+import github.Repository
 import pygit2
 from actions_toolkit.github import Context, get_octokit
 
 from .downloader import dl2, wait_dl_tasks
+from .ghapi import gh_api_delete, gh_api_paginate, gh_api_request
 from .logger import logger
-from .network import gh_api_request
+from .network import backoff
 from .paths import paths
 
-context = Context()
-user_repo = f'{context.repo.owner}/{context.repo.repo}'
+# 仓库Actions缓存的空间预算(GitHub的上限为10GB)
+CACHE_SIZE_BUDGET = 10 * 1000 ** 3
+# 工具链缓存的键前缀, 空间不足时最后淘汰
+TOOLCHAIN_CACHE_PREFIX = "toolchain-"
+CACHE_DELETE_WORKERS = 8
+# 同时上传的资产数与每个资产的最大尝试次数
+ASSET_UPLOAD_WORKERS = 4
+ASSET_UPLOAD_RETRY = 3
 
-token = os.getenv('GITHUB_TOKEN')
-with contextlib.suppress(Exception):
-    repo = get_octokit(token).rest.get_repo(user_repo)
 
-compiler = context.repo.owner
-if user_info := gh_api_request(f"https://api.github.com/users/{compiler}", token):
-    compiler = user_info.get("name", compiler)
+# 以下信息在第一次使用时才获取, 导入本模块不会产生任何网络请求
+@functools.cache
+def get_context() -> Context:
+    return Context()
+
+
+@functools.cache
+def get_user_repo() -> str:
+    context = get_context()
+    return f'{context.repo.owner}/{context.repo.repo}'
+
+
+@functools.cache
+def get_token() -> str | None:
+    return os.getenv('GITHUB_TOKEN')
+
+
+@functools.cache
+def get_repo() -> github.Repository.Repository:
+    return get_octokit(get_token()).rest.get_repo(get_user_repo())
+
+
+@functools.cache
+def get_compiler() -> str:
+    """编译者的名称, 获取不到GitHub用户名称时使用仓库所有者"""
+    compiler = get_context().repo.owner
+    if user_info := gh_api_request(f"https://api.github.com/users/{compiler}", get_token()):
+        compiler = user_info.get("name") or compiler
+    return compiler
 
 def get_current_commit() -> str:
     current_repo = pygit2.Repository(paths.openwrt_k)
@@ -33,16 +69,27 @@ def get_current_commit() -> str:
         head_commit = head_commit.raw.hex()
     return head_commit
 
-def dl_artifact(name: str, path: str) -> str:
-    for artifact in repo.get_artifacts():
-        if artifact.workflow_run.id == context.run_id and artifact.name == name:
-            dl_url = artifact.archive_download_url
-            logger.debug(f'Downloading artifact {name} from {dl_url}')
-            break
-    else:
+_run_artifacts: dict[str, dict] = {}
+
+
+def get_run_artifact(name: str) -> dict:
+    """在当前工作流运行的artifact中按名称查找, 结果在进程内缓存"""
+    if name not in _run_artifacts:
+        url = f"https://api.github.com/repos/{get_user_repo()}/actions/runs/{get_context().run_id}/artifacts?name={quote(name)}"
+        for artifact in gh_api_paginate(url, "artifacts", get_token()) or []:
+            if not artifact.get("expired"):
+                _run_artifacts[artifact["name"]] = artifact
+    if name not in _run_artifacts:
         msg = f'Artifact {name} not found'
         raise ValueError(msg)
-    if not token:
+    return _run_artifacts[name]
+
+
+def dl_artifact(name: str, path: str) -> str:
+    artifact = get_run_artifact(name)
+    dl_url = artifact["archive_download_url"]
+    logger.debug("Downloading artifact %s from %s", name, dl_url)
+    if not (token := get_token()):
         msg = "没有可用的token"
         raise KeyError(msg)
 
@@ -52,71 +99,220 @@ def dl_artifact(name: str, path: str) -> str:
                 "X-GitHub-Api-Version": "2022-11-28",
                 "Authorization": f'Bearer {token}',
             }
-    task = dl2(dl_url, os.path.join(path, name + ".zip"), headers=headers)
+    task = dl2(dl_url, os.path.join(path, name + ".zip"), headers=headers, cache=False, sha256=artifact.get("digest"))
     wait_dl_tasks([task])
     return os.path.join(path, name + ".zip")
 
-def del_cache(key_prefix: str) -> None:
-    headers = {
-                "Accept": "application/vnd.github+json",
-                "X-GitHub-Api-Version": "2022-11-28",
-                "Authorization": f'Bearer {token}',
-            }
-    if response := gh_api_request(f"https://api.github.com/repos/{user_repo}/actions/caches", token):
-        for cache in response["actions_caches"]:
-            cache: dict
-            if cache['key'].startswith(key_prefix):
-                logger.info(f'Deleting cache {cache["key"]}')
-                httpx.delete(f"https://api.github.com/repos/{user_repo}/actions/caches/{cache['id']}", headers=headers, timeout=10)
-    else:
+class CacheCleanupReport:
+    """一次Actions缓存清理的结果"""
+
+    def __init__(self) -> None:
+        self.deleted: list[str] = []
+        self.failed: list[str] = []
+        self.reclaimed = 0
+        self.remaining = 0
+
+    def __str__(self) -> str:
+        return (f"删除{len(self.deleted)}个缓存, 释放{self.reclaimed / 1024 ** 2:.1f}MiB, "
+                f"失败{len(self.failed)}个, 剩余{self.remaining / 1024 ** 3:.2f}GiB")
+
+
+def _select_caches(caches: list[dict], key_prefix: str, keep: int) -> list[dict]:
+    """选出需要删除的缓存: 匹配key_prefix的缓存只保留最新的keep个"""
+    matched = sorted((cache for cache in caches if cache["key"].startswith(key_prefix)),
+                     key=lambda cache: cache.get("created_at", ""), reverse=True)
+    return matched[keep:]
+
+
+def _select_over_budget(caches: list[dict], size_budget: int) -> list[dict]:
+    """选出需要删除的缓存: 总大小超出size_budget时按最近访问时间从旧到新淘汰, 先淘汰ccache等编译缓存, 再淘汰工具链缓存"""
+    total = sum(cache.get("size_in_bytes", 0) for cache in caches)
+    selected: list[dict] = []
+    for cache in sorted(caches, key=lambda cache: (cache["key"].startswith(TOOLCHAIN_CACHE_PREFIX), cache.get("last_accessed_at", ""))):
+        if total <= size_budget:
+            break
+        selected.append(cache)
+        total -= cache.get("size_in_bytes", 0)
+    return selected
+
+
+def _cleanup_caches(select: Callable[[list[dict]], list[dict]]) -> CacheCleanupReport:
+    """列出仓库的所有Actions缓存(遍历所有分页), 并发删除select选出的缓存"""
+    report = CacheCleanupReport()
+    caches = gh_api_paginate(f"https://api.github.com/repos/{get_user_repo()}/actions/caches", "actions_caches", get_token())
+    if caches is None:
         logger.error('Failed to get caches list')
+        return report
+
+    selected = select(caches)
+    report.remaining = sum(cache.get("size_in_bytes", 0) for cache in caches)
+
+    def delete(cache: dict) -> tuple[dict, bool]:
+        logger.info("Deleting cache %s", cache["key"])
+        return cache, gh_api_delete(f"https://api.github.com/repos/{get_user_repo()}/actions/caches/{cache['id']}", get_token())
+
+    if selected:
+        with ThreadPoolExecutor(CACHE_DELETE_WORKERS) as executor:
+            for cache, ok in executor.map(delete, selected):
+                if ok:
+                    report.deleted.append(cache["key"])
+                    report.reclaimed += cache.get("size_in_bytes", 0)
+                    report.remaining -= cache.get("size_in_bytes", 0)
+                else:
+                    report.failed.append(cache["key"])
+    logger.info("缓存清理完成: %s", report)
+    return report
+
+
+def del_cache(key_prefix: str, keep: int = 0) -> CacheCleanupReport:
+    """删除匹配key_prefix的Actions缓存, 只保留最新的keep个, 不影响其他前缀的缓存"""
+    return _cleanup_caches(lambda caches: _select_caches(caches, key_prefix, keep))
+
+
+def trim_caches(size_budget: int = CACHE_SIZE_BUDGET) -> CacheCleanupReport:
+    """仓库的Actions缓存总大小超出size_budget时, 淘汰所有配置中最久没有使用的缓存(工具链缓存最后淘汰)"""
+    return _cleanup_caches(lambda caches: _select_over_budget(caches, size_budget))
 
 def get_release_suffix(cfg: dict) -> tuple[str, str]:
     release_suffix = f"({cfg["target"]}-{cfg["subtarget"]})-[{cfg["compile"]["openwrt_tag/branch"]}]"
     tag_suffix = f"({cfg["target"]}-{cfg["subtarget"]})-({cfg["compile"]["openwrt_tag/branch"]})-{cfg["name"]}"
     return release_suffix, tag_suffix
 
+class ReleaseIndex:
+    """仓库发布的索引, 每个进程只列出一次所有发布, 之后随创建/删除增量更新
+
+    以tag的后缀(即get_release_suffix返回的tag_suffix)为键, 每个键下的发布按从新到旧排列。
+    """
+
+    TAG_PATTERN = re.compile(r"^v\d{4}\.\d{2}\.\d{2}-(?P<n>\d+)(?P<suffix>\(.*)$")
+
+    def __init__(self, releases: Iterable[github.GitRelease.GitRelease]) -> None:
+        self.tag_names: set[str] = set()
+        self.by_suffix: dict[str, list[github.GitRelease.GitRelease]] = {}
+        # 不符合命名格式的发布, 只能按后缀逐个比较
+        self.others: list[github.GitRelease.GitRelease] = []
+        for release in releases:
+            self._releases(release.tag_name).append(release)
+            self.tag_names.add(release.tag_name)
+
+    def _releases(self, tag_name: str) -> list[github.GitRelease.GitRelease]:
+        if match := self.TAG_PATTERN.match(tag_name):
+            return self.by_suffix.setdefault(match.group("suffix"), [])
+        return self.others
+
+    def add(self, release: github.GitRelease.GitRelease) -> None:
+        """添加新创建的发布"""
+        self._releases(release.tag_name).insert(0, release)
+        self.tag_names.add(release.tag_name)
+
+    def remove(self, release: github.GitRelease.GitRelease) -> None:
+        self.tag_names.discard(release.tag_name)
+        releases = self._releases(release.tag_name)
+        for i, r in enumerate(releases):
+            if r.tag_name == release.tag_name:
+                del releases[i]
+                break
+
+    def find(self, suffix: str) -> list[github.GitRelease.GitRelease]:
+        """获取tag以suffix结尾的发布, 从新到旧排列"""
+        return [*self.by_suffix.get(suffix, []), *(release for release in self.others if release.tag_name.endswith(suffix))]
+
+    def next_free(self, f_tag_name: str) -> int:
+        """获取f_tag_name中{n}的第一个未被使用的值"""
+        i = 0
+        while f_tag_name.format(n=i) in self.tag_names:
+            i += 1
+        return i
+
+
+_release_index: ReleaseIndex | None = None
+
+
+def get_release_index() -> ReleaseIndex:
+    global _release_index  # noqa: PLW0603
+    if _release_index is None:
+        _release_index = ReleaseIndex(get_repo().get_releases())
+        logger.debug("已索引%s个发布", len(_release_index.tag_names))
+    return _release_index
+
+
+_upload_local = threading.local()
+
+
+def _get_thread_release(release_id: int) -> github.GitRelease.GitRelease:
+    """获取当前线程自己的发布对象
+
+    PyGithub的Requester只保持一个持久连接, 主机名(uploads.github.com与api.github.com)变化时会重置连接,
+    不能在线程间共享, 因此每个上传线程使用单独的Github对象。
+    """
+    if getattr(_upload_local, "release_id", None) != release_id:
+        repo = get_octokit(get_token()).rest.get_repo(get_user_repo(), lazy=True)
+        _upload_local.release = repo.get_release(release_id)
+        _upload_local.release_id = release_id
+    return _upload_local.release
+
+
+def _upload_asset(release_id: int, path: str) -> None:
+    release = _get_thread_release(release_id)
+    name = os.path.basename(path)
+    for attempt in range(ASSET_UPLOAD_RETRY):
+        try:
+            logger.info("上传资产: %s", path)
+            release.upload_asset(path)
+        except Exception as e:
+            if attempt == ASSET_UPLOAD_RETRY - 1:
+                raise
+            delay = backoff(attempt)
+            logger.warning("上传资产%s失败(%s), %.1f秒后重试", name, f"{e.__class__.__name__}: {e!s}", delay)
+            time.sleep(delay)
+            # 上传失败可能留下状态为starter的不完整资产, 重新上传前需要先删除同名资产
+            for asset in release.get_assets():
+                if asset.name == name:
+                    logger.debug("删除不完整的资产: %s", name)
+                    asset.delete_asset()
+        else:
+            return
+
+
+def upload_assets(release: github.GitRelease.GitRelease, assets: list[str]) -> None:
+    """并发上传资产, 先上传最大的文件, 任一资产最终上传失败时抛出第一个错误"""
+    assets = sorted(assets, key=os.path.getsize, reverse=True)
+    with ThreadPoolExecutor(ASSET_UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(_upload_asset, release.id, asset) for asset in assets]
+    for future in futures:
+        future.result()
+
+
 def new_release(cfg: dict, assets: list[str], body: str) -> None:
     release_suffix, tag_suffix = get_release_suffix(cfg)
     f_release_name = "v" + datetime.now(timezone(timedelta(hours=8))).strftime('%Y.%m.%d') + "-{n}" + release_suffix
     f_tag_name = "v" + datetime.now(timezone(timedelta(hours=8))).strftime('%Y.%m.%d') + "-{n}" + tag_suffix
 
-    releases = repo.get_releases()
-    tag_names = [release.tag_name for release in releases]
-
-    i = 0
-    while True:
-        tag_name = f_tag_name.format(n=i)
-        if tag_name not in tag_names:
-            release_name = f_release_name.format(n=i)
-            break
-        i += 1
+    index = get_release_index()
+    old_releases = index.find(tag_suffix)
+    i = index.next_free(f_tag_name)
+    tag_name = f_tag_name.format(n=i)
+    release_name = f_release_name.format(n=i)
 
     head_commit = get_current_commit()
 
     logger.info("创建新发布: %s", release_name)
-    release = repo.create_git_tag_and_release(tag_name,
+    release = get_repo().create_git_tag_and_release(tag_name,
                                               f"发布新版本:{release_name}",
                                               release_name,
                                               body,
                                               head_commit,
                                               "commit",
                                               )
-    for asset in assets:
-        logger.info("上传资产: %s", asset)
-        release.upload_asset(asset)
+    index.add(release)
+    upload_assets(release, assets)
 
     try:
-        headers = {
-            "Accept": "application/vnd.github+json",
-            "X-GitHub-Api-Version": "2022-11-28",
-            "Authorization": f'Bearer {token}',
-        }
-        for release in releases:
-            if release.tag_name.endswith(tag_suffix) and release.tag_name != tag_name:
-                logger.info("删除旧版本: %s", release.tag_name)
-                release.delete_release()
-                httpx.delete(f"https://api.github.com/repos/{user_repo}/git/refs/tags/{release.tag_name}", headers=headers, timeout=10)
+        for old_release in old_releases:
+            logger.info("删除旧版本: %s", old_release.tag_name)
+            old_release.delete_release()
+            gh_api_delete(f"https://api.github.com/repos/{get_user_repo()}/git/refs/tags/{old_release.tag_name}", get_token())
+            index.remove(old_release)
 
     except Exception:
         logger.exception("删除旧版本失败")
@@ -125,10 +321,6 @@ def new_release(cfg: dict, assets: list[str], body: str) -> None:
 def match_releases(cfg: dict) -> github.GitRelease.GitRelease | None:
     _, suffix = get_release_suffix(cfg)
 
-    releases = repo.get_releases()
-
-    matched_releases = [release for release in releases if release.tag_name.endswith(suffix)]
-
-    if matched_releases:
+    if matched_releases := get_release_index().find(suffix):
         return matched_releases[0]
     return None
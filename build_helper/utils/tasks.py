@@ -0,0 +1,253 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from types import FrameType
+from typing import Any
+
+from .logger import logger
+
+
+class CancelledError(Exception):
+    """任务所在的任务组已被取消"""
+
+    def __init__(self) -> None:
+        super().__init__("任务已取消")
+
+
+class TaskGroup:
+    """一组相互关联的任务, 其中一个失败时取消整组
+
+    取消时依次调用注册的回调(终止子进程与进程池、取消下载等), 正在运行的任务应通过check()及时退出。
+    """
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.callbacks: list[Callable[[], Any]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def add_callback(self, callback: Callable[[], Any]) -> None:
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], Any]) -> None:
+        with self.lock, contextlib.suppress(ValueError):
+            self.callbacks.remove(callback)
+
+    def cancel(self) -> None:
+        with self.lock:
+            if self.cancelled:
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("执行取消回调时出错")
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise CancelledError
+
+
+_task_group = TaskGroup()
+
+
+def get_task_group() -> TaskGroup:
+    """获取当前的任务组, 没有运行中的任务图时返回一个不会被取消的任务组"""
+    return _task_group
+
+
+def set_task_group(group: TaskGroup) -> TaskGroup:
+    global _task_group
+    previous, _task_group = _task_group, group
+    return previous
+
+
+_processes: set[subprocess.Popen] = set()
+_processes_lock = threading.Lock()
+
+
+def kill_processes() -> None:
+    """终止所有通过run_command启动的子进程及其创建的进程"""
+    with _processes_lock:
+        processes = list(_processes)
+    for process in processes:
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def run_command(args: list[str], cwd: str | None = None, capture_output: bool = False, text: bool = False,
+                check: bool = False) -> subprocess.CompletedProcess:
+    """与subprocess.run类似, 但子进程在单独的进程组中运行, 任务组取消时会被连同其子进程一起终止"""
+    group = get_task_group()
+    group.check()
+    pipe = subprocess.PIPE if capture_output else None
+    with subprocess.Popen(args, cwd=cwd, stdout=pipe, stderr=pipe, text=text, start_new_session=True) as process:
+        with _processes_lock:
+            _processes.add(process)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            with _processes_lock:
+                _processes.discard(process)
+    group.check()
+    result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
+
+
+def _terminate_worker(signum: int, _frame: FrameType | None) -> None:
+    kill_processes()
+    os._exit(128 + signum)
+
+
+def init_worker() -> None:
+    """进程池的初始化函数, 进程池被终止(SIGTERM)时先终止工作进程启动的子进程"""
+    signal.signal(signal.SIGTERM, _terminate_worker)
+
+
+class Task:
+    def __init__(self, name: str, func: Callable[..., Any], args: tuple, deps: list["Task"], cleanup: Iterable[str] = ()) -> None:
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = deps
+        # 任务未成功完成时需要删除的路径
+        self.cleanup = list(cleanup)
+        self.start: float | None = None
+        self.end: float | None = None
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+    @property
+    def duration(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    def run(self) -> Any:
+        self.start = time.monotonic()
+        try:
+            self.result = self.func(*self.args)
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self.end = time.monotonic()
+        return self.result
+
+
+class TaskGraph:
+    """按依赖关系执行的任务图
+
+    任务在所有依赖完成后立即在线程池中开始执行, 执行结束后可以获取关键路径(决定总耗时的最长依赖链)。
+    任一任务失败时取消整个任务组, 并删除未成功完成的任务留下的路径。
+    """
+
+    def __init__(self, max_workers: int = 8) -> None:
+        self.max_workers = max_workers
+        self.tasks: dict[str, Task] = {}
+        self.group = TaskGroup()
+        self.group.add_callback(kill_processes)
+        self.start = 0.0
+        self.end = 0.0
+
+    def add(self, name: str, func: Callable[..., Any], *args: Any, deps: Iterable[str | Task] = (), cleanup: Iterable[str] = ()) -> Task:
+        if name in self.tasks:
+            msg = f"任务{name}已存在"
+            raise ValueError(msg)
+        task = Task(name, func, args, [dep if isinstance(dep, Task) else self.tasks[dep] for dep in deps], cleanup)
+        self.tasks[name] = task
+        return task
+
+    def run(self) -> dict[str, Any]:
+        """执行所有任务并返回各任务的结果, 任一任务失败时不再启动新任务, 等待已启动的任务结束后抛出第一个错误"""
+        pending = dict(self.tasks)
+        done: set[str] = set()
+        running: dict[Future, Task] = {}
+        error: BaseException | None = None
+        self.start = time.monotonic()
+        previous_group = set_task_group(self.group)
+        try:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                try:
+                    while pending or running:
+                        if error is None:
+                            for name, task in list(pending.items()):
+                                if all(dep.name in done for dep in task.deps):
+                                    logger.debug("开始任务: %s", name)
+                                    running[executor.submit(task.run)] = task
+                                    del pending[name]
+                        # 依赖只能引用已添加的任务, 不会出现循环依赖, 没有运行中的任务说明已经结束或出错
+                        if not running:
+                            break
+                        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            task = running.pop(future)
+                            if isinstance(e := future.exception(), CancelledError):
+                                logger.debug("任务%s已取消", task.name)
+                            elif e is not None:
+                                logger.error("任务%s失败: %s", task.name, f"{e.__class__.__name__}: {e!s}")
+                                error = error or e
+                                # 取消其余任务, 让它们尽快结束
+                                self.group.cancel()
+                            else:
+                                logger.debug("任务%s完成, 耗时%.2f秒", task.name, task.duration)
+                                done.add(task.name)
+                except BaseException:
+                    # 退出线程池前需要先取消, 否则会一直等待正在运行的任务
+                    self.group.cancel()
+                    raise
+        finally:
+            set_task_group(previous_group)
+            self.end = time.monotonic()
+        if error is not None:
+            self._cleanup(done)
+            raise error
+        return {name: task.result for name, task in self.tasks.items()}
+
+    def _cleanup(self, done: set[str]) -> None:
+        for task in self.tasks.values():
+            if task.start is None or task.name in done:
+                continue
+            for path in task.cleanup:
+                logger.info("删除任务%s未完成的文件: %s", task.name, path)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.lexists(path):
+                    os.remove(path)
+
+    def critical_path(self) -> list[Task]:
+        """从最后结束的任务开始, 每次沿最后结束的依赖向前回溯"""
+        finished = [task for task in self.tasks.values() if task.end is not None]
+        if not finished:
+            return []
+        task = max(finished, key=lambda task: task.end or 0)
+        path = [task]
+        while deps := [dep for dep in task.deps if dep.end is not None]:
+            task = max(deps, key=lambda task: task.end or 0)
+            path.append(task)
+        return path[::-1]
+
+    def report(self) -> None:
+        path = self.critical_path()
+        total = self.end - self.start
+        logger.info("总耗时%.2f秒, 关键路径(%.2f秒): %s", total, sum(task.duration for task in path),
+                    " -> ".join(f"{task.name}({task.duration:.2f}s)" for task in path))
@@ -11,10 +11,17 @@ from .paths import paths
 class UpLoader:
     def __init__(self) -> None:
         self.action_file = os.path.join(paths.openwrt_k, ".github", "action", "upload", "action.yml")
-        logger.debug(f"UpLoad Action file: {self.action_file}")
-        with open(self.action_file, encoding='utf-8') as file:
-            self.action = yaml.load(file, Loader=yaml.FullLoader)  # noqa: S506
-        self.action['runs']['steps'] = []
+        self._action: dict | None = None
+
+    @property
+    def action(self) -> dict:
+        """上传Action的内容, 第一次使用时才读取"""
+        if self._action is None:
+            logger.debug(f"UpLoad Action file: {self.action_file}")
+            with open(self.action_file, encoding='utf-8') as file:
+                self._action = yaml.load(file, Loader=yaml.FullLoader)  # noqa: S506
+            self._action['runs']['steps'] = []
+        return self._action
 
     def add(self,
             name: str,
@@ -51,7 +58,8 @@ class UpLoader:
         self.action['runs']['steps'].append(action)
 
     def save(self) -> None:
-        if self.action['runs']['steps']:
+        # 没有添加过任何Artifact时不需要读取和写入Action文件
+        if self._action is not None and self.action['runs']['steps']:
             logger.debug("Save UpLoad Action file to %s", self.action_file)
             with open(self.action_file, 'w', encoding='utf-8') as file:
                 yaml.dump(self.action, file, allow_unicode=True, sort_keys=False)